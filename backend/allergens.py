@@ -0,0 +1,217 @@
+import re
+
+# Bump whenever the taxonomy below changes so stored masks get recomputed
+TAXONOMY_VERSION = 2
+
+# Bit positions are persisted in meals.allergen_mask: only ever append groups
+ALLERGEN_GROUPS = [
+    ('peanut', ['peanut', 'groundnut', 'arachis oil']),
+    ('tree_nut', ['tree nut', 'nut', 'almond', 'walnut', 'cashew', 'pecan', 'pistachio', 'hazelnut',
+                  'macadamia', 'brazil nut', 'pine nut', 'praline', 'marzipan', 'pesto', 'almond flour']),
+    ('dairy', ['dairy', 'milk', 'cheese', 'butter', 'cream', 'yogurt', 'yoghurt', 'whey', 'casein',
+               'lactose', 'ghee', 'feta', 'parmesan', 'mozzarella', 'cheddar', 'ricotta', 'paneer',
+               'buttermilk', 'sour cream', 'ice cream', 'custard']),
+    ('egg', ['egg', 'egg white', 'egg yolk', 'yolk', 'mayonnaise', 'mayo', 'meringue', 'aioli']),
+    ('gluten', ['gluten', 'wheat', 'barley', 'rye', 'bread', 'tortilla', 'pasta', 'noodle', 'couscous',
+                'bulgur', 'farro', 'spelt', 'semolina', 'seitan', 'flour', 'breadcrumb', 'crouton',
+                'pita', 'naan', 'bun', 'cracker', 'soy sauce', 'teriyaki']),
+    ('soy', ['soy', 'soya', 'soybean', 'tofu', 'tempeh', 'edamame', 'miso', 'tamari', 'soy sauce',
+             'soy milk', 'teriyaki']),
+    ('fish', ['fish', 'salmon', 'tuna', 'cod', 'trout', 'anchovy', 'sardine', 'mackerel', 'tilapia',
+              'halibut', 'haddock', 'bass', 'fish sauce']),
+    ('shellfish', ['shellfish', 'shrimp', 'prawn', 'crab', 'lobster', 'crayfish', 'scallop', 'clam',
+                   'mussel', 'oyster', 'squid', 'calamari', 'octopus']),
+    ('sesame', ['sesame', 'tahini', 'hummus']),
+    ('mustard', ['mustard']),
+    ('celery', ['celery', 'celeriac']),
+    ('lupin', ['lupin', 'lupine']),
+]
+
+ALLERGEN_BITS = {name: 1 << index for index, (name, _) in enumerate(ALLERGEN_GROUPS)}
+
+# Compound ingredients whose words would otherwise match the wrong group,
+# e.g. "peanut butter" is not dairy and "coconut milk" is neither
+COMPOUND_INGREDIENTS = {
+    'peanut butter': ['peanut'],
+    'almond butter': ['tree_nut'],
+    'cashew butter': ['tree_nut'],
+    'almond milk': ['tree_nut'],
+    'cashew milk': ['tree_nut'],
+    'coconut milk': [],
+    'coconut cream': [],
+    'coconut flour': [],
+    'oat milk': [],
+    'rice milk': [],
+    'rice flour': [],
+    'rice noodle': [],
+    'corn tortilla': [],
+    'cocoa butter': [],
+    'shea butter': [],
+    'cream of tartar': [],
+    'vegan cheese': [],
+    'vegan butter': [],
+    'vegan mayo': [],
+    'oyster mushroom': [],
+    'butter bean': [],
+    'egg free': [],
+    'dairy free': [],
+    'gluten free': [],
+}
+
+# Names people use for their allergy that are broader than any single ingredient
+ALLERGY_ALIASES = {
+    'nut': ['peanut', 'tree_nut'],
+    'seafood': ['fish', 'shellfish'],
+    'wheat': ['gluten'],
+    'celiac': ['gluten'],
+    'coeliac': ['gluten'],
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_MAX_PHRASE_WORDS = 3
+
+# Singular words that end in "s" and must not lose it
+_S_SINGULARS = {'hummus', 'couscous', 'asparagus', 'octopus', 'citrus', 'hibiscus', 'molasses', 'swiss',
+                'haggis'}
+# Singular words ending in "ie", whose plural would otherwise become "-y"
+_IE_SINGULARS = {'cookie', 'brownie', 'veggie', 'smoothie', 'calorie', 'hoagie', 'sweetie'}
+
+
+def normalize_ingredient(text):
+    """Lowercase, drop punctuation and singularize each word"""
+    if not text:
+        return ''
+    return ' '.join(_singular(token) for token in _TOKEN_RE.findall(str(text).lower()))
+
+
+def _singular(word):
+    if len(word) <= 3 or not word.endswith('s') or word in _S_SINGULARS:
+        return word
+    if word.endswith('ies') and len(word) > 4:
+        # "anchovies" -> "anchovy", "cookies" -> "cookie"
+        return word[:-1] if word[:-1] in _IE_SINGULARS else word[:-3] + 'y'
+    if word.endswith(('sses', 'ches', 'shes', 'xes', 'zes', 'oes')) or word[:-2] in _S_SINGULARS:
+        # "tomatoes" -> "tomato", "radishes" -> "radish", "hummuses" -> "hummus"
+        return word[:-2]
+    if word.endswith('ss'):
+        return word
+    return word[:-1]
+
+
+def _plural(word):
+    """Regular English plural, used to check that normalization undoes it"""
+    if word.endswith('y') and word[-2:-1] not in ('a', 'e', 'i', 'o', 'u'):
+        return word[:-1] + 'ies'
+    if word.endswith(('s', 'x', 'z', 'ch', 'sh', 'o')):
+        return word + 'es'
+    return word + 's'
+
+
+def plural_mismatches(terms):
+    """Terms whose plural does not normalize to the same phrase as the term"""
+    mismatches = []
+    for term in terms:
+        words = term.split()
+        plural = ' '.join(words[:-1] + [_plural(words[-1])])
+        if normalize_ingredient(plural) != normalize_ingredient(term):
+            mismatches.append(term)
+    return mismatches
+
+
+def _mask_of(groups):
+    mask = 0
+    for group in groups:
+        mask |= ALLERGEN_BITS[group]
+    return mask
+
+
+def _build_phrase_index():
+    # A term that misses its own plural silently lets allergens through
+    terms = [term for _, group_terms in ALLERGEN_GROUPS for term in group_terms]
+    mismatches = plural_mismatches(terms + list(COMPOUND_INGREDIENTS) + list(ALLERGY_ALIASES))
+    if mismatches:
+        raise ValueError(f"Allergen terms that do not match their plural: {mismatches}")
+    index = {}
+    for name, terms in ALLERGEN_GROUPS:
+        for term in terms:
+            phrase = normalize_ingredient(term)
+            index[phrase] = index.get(phrase, 0) | ALLERGEN_BITS[name]
+    # Compounds override whatever their individual words would map to
+    for phrase, groups in COMPOUND_INGREDIENTS.items():
+        index[normalize_ingredient(phrase)] = _mask_of(groups)
+    return index
+
+
+_PHRASE_INDEX = _build_phrase_index()
+_ALIAS_INDEX = {normalize_ingredient(alias): _mask_of(groups) for alias, groups in ALLERGY_ALIASES.items()}
+
+
+def ingredient_mask(ingredient):
+    """Allergen bitmask for one ingredient using greedy longest-phrase matching"""
+    words = normalize_ingredient(ingredient).split()
+    mask = 0
+    i = 0
+    while i < len(words):
+        for size in range(min(_MAX_PHRASE_WORDS, len(words) - i), 0, -1):
+            phrase = ' '.join(words[i:i + size])
+            if phrase in _PHRASE_INDEX:
+                mask |= _PHRASE_INDEX[phrase]
+                i += size
+                break
+        else:
+            i += 1
+    return mask
+
+
+def meal_allergen_mask(ingredients):
+    """Allergen bitmask for a meal: the union over its ingredients"""
+    mask = 0
+    for ingredient in ingredients or []:
+        mask |= ingredient_mask(ingredient)
+    return mask
+
+
+def allergy_mask(allergies):
+    """Split user allergies into a group bitmask and terms outside the taxonomy.
+
+    Unknown terms are returned as given so callers can still exclude meals
+    listing that exact ingredient.
+    """
+    mask = 0
+    unmatched = []
+    for allergy in allergies or []:
+        normalized = normalize_ingredient(allergy)
+        if not normalized:
+            continue
+        bits = _ALIAS_INDEX.get(normalized, 0) | ingredient_mask(normalized)
+        if bits:
+            mask |= bits
+        else:
+            unmatched.append(str(allergy).strip())
+    return mask, unmatched
+
+
+def allergen_names(mask):
+    """Group names set in a bitmask"""
+    return [name for name, _ in ALLERGEN_GROUPS if mask & ALLERGEN_BITS[name]]
+
+
+def is_meal_safe(meal, mask, unmatched=()):
+    """Check an in-memory meal dict against an allergy mask from `allergy_mask`"""
+    meal_mask = meal.get('allergen_mask')
+    if meal_mask is None:
+        meal_mask = meal_allergen_mask(meal.get('ingredients'))
+    if meal_mask & mask:
+        return False
+    if unmatched:
+        ingredients = {normalize_ingredient(i) for i in meal.get('ingredients') or []}
+        return not any(normalize_ingredient(term) in ingredients for term in unmatched)
+    return True
+
+
+def filter_safe_meals(meals, allergies):
+    """Drop meals that conflict with any of the given allergies"""
+    mask, unmatched = allergy_mask(allergies)
+    if not mask and not unmatched:
+        return list(meals)
+    return [meal for meal in meals if is_meal_safe(meal, mask, unmatched)]
@@ -1,13 +1,24 @@
 import os
 import uuid
 import json
-from flask import Flask, request, jsonify, make_response
+import base64
+import datetime
+import time
+from flask import Flask, request, jsonify, make_response, Response, stream_with_context, g
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import Config
 from database import Database
 from recommender import MealRecommender
+from catalog import MealCatalog
+from similarity import SimilarMealsIndex
+from search import MealSearchIndex, IngredientAutocomplete
+from meal_planner import MealPlanner, MealPlanError
+from materialized import MaterializedRecommendations
+from traffic import TrafficRecorder
 from models import UserPreferences
 from auth import AuthService, token_required
+from rate_limiter import AdmissionController, InProcessBackend, SharedStoreBackend, LocalKeyValueStore, client_key
 
 app = Flask(__name__)
 
@@ -25,8 +36,121 @@ config = Config()
 db = Database()
 recommender = MealRecommender()
 auth_service = AuthService()
+catalog = MealCatalog(db)
+similar_index = SimilarMealsIndex()
+search_index = MealSearchIndex()
+ingredient_autocomplete = IngredientAutocomplete()
+catalog.add_listener(similar_index)
+catalog.add_listener(search_index)
+meal_planner = MealPlanner(recommender, time_budget_ms=config.PLAN_TIME_BUDGET_MS)
+catalog.add_listener(ingredient_autocomplete)
+catalog.add_listener(meal_planner)
+materialized = MaterializedRecommendations(recommender, db, max_buckets=config.MATERIALIZED_BUCKETS,
+                                           min_users=config.MATERIALIZED_MIN_USERS)
+recommender.materialized = materialized
+catalog.add_listener(materialized)
 db_initialized = False
 
+# --- Admission control ---
+if config.TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.TRUSTED_PROXY_COUNT)
+if config.RATE_LIMIT_BACKEND == 'shared':
+    limiter_backend = SharedStoreBackend(LocalKeyValueStore())
+else:
+    limiter_backend = InProcessBackend()
+admission = AdmissionController(limiter_backend, enabled=config.RATE_LIMIT_ENABLED,
+                                by_address=config.RATE_LIMIT_BY_ADDRESS)
+if config.RATE_LIMIT_ENABLED and not config.TRUSTED_PROXY_COUNT:
+    if config.RATE_LIMIT_BY_ADDRESS:
+        app.logger.warning("Rate limiting by client address with TRUSTED_PROXY_COUNT=0: behind a proxy "
+                           "every anonymous caller shares one bucket")
+    else:
+        app.logger.warning("Per-address rate limits are off until TRUSTED_PROXY_COUNT is set; signed-in "
+                           "users are still limited per user and load shedding stays on")
+shed_options = {
+    'target_delay': config.SHED_TARGET_DELAY_MS / 1000,
+    'interval': config.SHED_INTERVAL_MS / 1000
+}
+
+def user_or_ip_key():
+    """Rate limit signed-in users by id and anonymous callers by address"""
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        user_id = auth_service.verify_token(auth_header[7:])
+        if user_id:
+            return f'user:{user_id}'
+    return client_key()
+
+def catalog_loading():
+    """503 for index-backed routes until the catalog's first load finishes"""
+    response = jsonify({'error': 'Meal catalog is loading, please retry'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '2'
+    return response
+
+def parse_list_param(value):
+    """Accept list params either as JSON arrays or comma-separated strings"""
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return value or []
+
+def preferences_from_body(data):
+    """Build preferences from a JSON request body"""
+    return UserPreferences(
+        diet_type=data.get('diet_type', 'any'),
+        preferences=parse_list_param(data.get('preferences', [])),
+        allergies=parse_list_param(data.get('allergies', [])),
+        health_goal=data.get('health_goal', 'maintain')
+    )
+
+def preferences_from_query(user_id=None):
+    """Build preferences from query args, falling back to the user's saved ones"""
+    saved = db.get_user_preferences(user_id) if user_id else None
+    saved = saved or {}
+    return UserPreferences(
+        diet_type=request.args.get('diet_type', saved.get('diet_type') or 'any'),
+        preferences=parse_list_param(request.args.get('preferences', saved.get('preferences'))),
+        allergies=parse_list_param(request.args.get('allergies', saved.get('allergies'))),
+        health_goal=request.args.get('health_goal', saved.get('health_goal') or 'maintain')
+    )
+
+def encode_history_cursor(row):
+    """Opaque page token pointing just past a history row"""
+    raw = f"{row['viewed_at'].isoformat()}|{row['history_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_history_cursor(token):
+    """(viewed_at, history_id) from a page token; ValueError if malformed"""
+    try:
+        viewed_at, history_id = base64.urlsafe_b64decode(token.encode()).decode().split('|')
+        return datetime.datetime.fromisoformat(viewed_at), int(history_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+# --- Traffic capture ---
+traffic_recorder = None
+if config.TRAFFIC_CAPTURE_ENABLED:
+    traffic_recorder = TrafficRecorder(config.TRAFFIC_CAPTURE_PATH, config.TRAFFIC_CAPTURE_SAMPLE_RATE)
+
+@app.before_request
+def start_capture_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def capture_request(response):
+    if traffic_recorder is not None:
+        try:
+            duration_ms = (time.perf_counter() - g.request_started) * 1000
+            traffic_recorder.capture(request, response, duration_ms)
+        except Exception as e:
+            app.logger.error(f"Traffic capture error: {e}")
+    return response
+
 # --- Initialize database once ---
 @app.before_request
 def initialize_db_once():
@@ -34,6 +158,8 @@ def initialize_db_once():
     if not db_initialized:
         db.initialize_database()
         db_initialized = True
+        # Build and refresh the in-memory indexes off the request path
+        catalog.start()
 
 # --- Handle preflight OPTIONS requests globally ---
 @app.before_request
@@ -48,6 +174,8 @@ def handle_options_preflight():
 
 # --- Auth Routes ---
 @app.route('/api/auth/register', methods=['POST'])
+@admission.limit('register', rate=config.AUTH_RATE, burst=config.AUTH_BURST,
+                 max_in_flight=config.AUTH_MAX_IN_FLIGHT, **shed_options)
 def register():
     try:
         data = request.get_json()
@@ -62,6 +190,8 @@ def register():
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/auth/login', methods=['POST'])
+@admission.limit('login', rate=config.AUTH_RATE, burst=config.AUTH_BURST,
+                 max_in_flight=config.AUTH_MAX_IN_FLIGHT, **shed_options)
 def login():
     try:
         data = request.get_json()
@@ -102,13 +232,40 @@ def user_preferences(current_user):
 @token_required
 def user_history(current_user):
     try:
-        limit = request.args.get('limit', 10, type=int)
-        history = db.get_meal_history(current_user.id, limit)
-        return jsonify({'history': history}), 200
+        limit = request.args.get('limit', config.HISTORY_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, config.HISTORY_MAX_PAGE_SIZE))
+        cursor = request.args.get('cursor')
+        try:
+            before = decode_history_cursor(cursor) if cursor else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        history = db.get_meal_history(current_user.id, limit, before)
+        next_cursor = encode_history_cursor(history[-1]) if len(history) == limit else None
+        return jsonify({'history': history, 'next_cursor': next_cursor}), 200
     except Exception as e:
         app.logger.error(f"User history error: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/user/export', methods=['GET'])
+@admission.limit('export', rate=config.EXPORT_RATE, burst=config.EXPORT_BURST, key_func=user_or_ip_key)
+@token_required
+def user_export(current_user):
+    """Stream the user's full history and feedback as NDJSON"""
+    user_id = current_user.id
+
+    def generate():
+        try:
+            for kind, rows in db.iter_user_export(user_id, config.EXPORT_FETCH_SIZE):
+                yield ''.join(json.dumps({'type': kind, **row}, default=json_default) + '\n' for row in rows)
+        except Exception as e:
+            # Headers are already sent; end the stream with an error record
+            app.logger.error(f"User export error: {e}")
+            yield json.dumps({'type': 'error', 'error': 'Export interrupted'}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Content-Disposition': 'attachment; filename="nutriguide-export.ndjson"'})
+
 # --- Health Check ---
 @app.route('/api/health', methods=['POST'])
 def health_check():
@@ -116,21 +273,12 @@ def health_check():
 
 # --- Recommendations ---
 @app.route('/api/recommendations', methods=['POST'])
+@admission.limit('recommendations', rate=config.RECOMMENDATIONS_RATE, burst=config.RECOMMENDATIONS_BURST,
+                 max_in_flight=config.RECOMMENDATIONS_MAX_IN_FLIGHT, key_func=user_or_ip_key, **shed_options)
 def get_recommendations():
     try:
         data = request.get_json() or {}
-        allergies_input = data.get('allergies', [])
-        if isinstance(allergies_input, str):
-            allergies = [item.strip() for item in allergies_input.split(',') if item.strip()]
-        else:
-            allergies = allergies_input
-
-        user_prefs = UserPreferences(
-            diet_type=data.get('diet_type', 'any'),
-            preferences=data.get('preferences', []),
-            allergies=allergies,
-            health_goal=data.get('health_goal', 'maintain')
-        )
+        user_prefs = preferences_from_body(data)
 
         session_id = request.headers.get('X-Session-ID', str(uuid.uuid4()))
         user_id = None
@@ -147,12 +295,95 @@ def get_recommendations():
                 user_prefs.health_goal
             )
 
-        recommendations = recommender.generate_recommendations(user_prefs)
+        recommendations = recommender.generate_recommendations(user_prefs, user_id)
         return jsonify({'session_id': session_id, 'recommendations': recommendations})
     except Exception as e:
         app.logger.error(f"Error generating recommendations: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+# --- Meal plan ---
+@app.route('/api/meal-plan', methods=['POST'])
+@admission.limit('meal-plan', rate=config.RECOMMENDATIONS_RATE, burst=config.RECOMMENDATIONS_BURST,
+                 max_in_flight=config.RECOMMENDATIONS_MAX_IN_FLIGHT, key_func=user_or_ip_key, **shed_options)
+def create_meal_plan():
+    try:
+        data = request.get_json() or {}
+        calorie_target = data.get('calorie_target')
+        if calorie_target is not None and (not isinstance(calorie_target, (int, float)) or calorie_target <= 0):
+            return jsonify({'error': 'calorie_target must be a positive number'}), 400
+
+        if not catalog.ready:
+            return catalog_loading()
+        plan = meal_planner.plan(preferences_from_body(data), calorie_target)
+        return jsonify({'plan': plan})
+    except MealPlanError as e:
+        return jsonify({'error': str(e)}), 422
+    except Exception as e:
+        app.logger.error(f"Error generating meal plan: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+# --- Similar meals ---
+@app.route('/api/meals/<int:meal_id>/similar', methods=['GET'])
+@admission.limit('similar', rate=config.RECOMMENDATIONS_RATE, burst=config.RECOMMENDATIONS_BURST,
+                 key_func=user_or_ip_key)
+def similar_meals(meal_id):
+    try:
+        if not catalog.ready:
+            return catalog_loading()
+        if catalog.get(meal_id) is None:
+            # Ids from the previous catalog version map to the same meal
+            meal_id = db.resolve_meal_id(meal_id)
+            if meal_id is None or catalog.get(meal_id) is None:
+                return jsonify({'error': 'Meal not found'}), 404
+
+        user_id = None
+        auth_header = request.headers.get('Authorization')
+        if auth_header and auth_header.startswith('Bearer '):
+            user_id = auth_service.verify_token(auth_header[7:])
+
+        limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+        similar = similar_index.similar(meal_id, limit, preferences_from_query(user_id))
+        return jsonify({'meal_id': meal_id, 'similar': similar})
+    except Exception as e:
+        app.logger.error(f"Error finding similar meals: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+# --- Search ---
+@app.route('/api/meals/search', methods=['GET'])
+@admission.limit('search', rate=config.SEARCH_RATE, burst=config.SEARCH_BURST, key_func=user_or_ip_key)
+def search_meals():
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'Missing query'}), 400
+        if not catalog.ready:
+            return catalog_loading()
+
+        user_id = None
+        auth_header = request.headers.get('Authorization')
+        if auth_header and auth_header.startswith('Bearer '):
+            user_id = auth_service.verify_token(auth_header[7:])
+
+        limit = max(1, min(request.args.get('limit', 20, type=int), 50))
+        results = search_index.search(query, limit, preferences_from_query(user_id))
+        return jsonify({'query': query, 'results': results})
+    except Exception as e:
+        app.logger.error(f"Error searching meals: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/ingredients/autocomplete', methods=['GET'])
+@admission.limit('autocomplete', rate=config.SEARCH_RATE, burst=config.SEARCH_BURST)
+def autocomplete_ingredients():
+    try:
+        prefix = request.args.get('q', '')
+        if not catalog.ready:
+            return catalog_loading()
+        limit = max(1, min(request.args.get('limit', 10, type=int), 10))
+        return jsonify({'query': prefix, 'suggestions': ingredient_autocomplete.suggest(prefix, limit)})
+    except Exception as e:
+        app.logger.error(f"Error autocompleting ingredients: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 # --- Feedback ---
 @app.route('/api/feedback', methods=['POST'])
 @token_required
@@ -161,7 +392,8 @@ def submit_feedback(current_user):
         data = request.get_json()
         if not data or 'meal_id' not in data or 'liked' not in data:
             return jsonify({'error': 'Missing required fields'}), 400
-        db.save_meal_feedback(current_user.id, data['meal_id'], data['liked'], data.get('feedback'))
+        if not db.save_meal_feedback(current_user.id, data['meal_id'], data['liked'], data.get('feedback')):
+            return jsonify({'error': 'Meal not found'}), 404
         return jsonify({'message': 'Feedback submitted successfully'})
     except Exception as e:
         app.logger.error(f"Error saving feedback: {e}")
@@ -171,13 +403,16 @@ def submit_feedback(current_user):
 @app.route('/api/admin/reset-meals', methods=['POST'])
 def reset_meals():
     try:
-        success = db.reset_meals_data()
-        if success:
-            return jsonify({'message': 'Meals data reset successfully'})
-        return jsonify({'error': 'Failed to reset meals data'}), 500
+        version = db.reset_meals_data()
+        catalog.refresh(force=True)
+        return jsonify({'message': 'Meals data reset successfully', 'catalog_version': version})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/metrics', methods=['GET'])
+def admin_metrics():
+    return jsonify({'admission': admission.snapshot(), 'materialized': materialized.snapshot()})
+
 # --- Error Handlers ---
 @app.errorhandler(404)
 def not_found(error):
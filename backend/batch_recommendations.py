@@ -0,0 +1,315 @@
+"""Offline recommendations for every user with saved preferences.
+
+Usage:
+    python batch_recommendations.py --output jsonl --path recommendations.jsonl [--resume]
+    python batch_recommendations.py --output table [--resume]
+    python batch_recommendations.py --synthetic-users 1000000 --path /tmp/recommendations.jsonl
+
+Users are streamed from user_preferences in user_id order and scored in
+chunks by a pool of worker processes. Each worker holds the catalog with
+MealRecommender scores precomputed per health goal. Inside a worker, users
+sharing a preference signature (diet, cuisines, allergies, goal) are
+ranked once. Output is written in chunk order, so the last written user_id
+is a checkpoint: a JSONL run records it next to the output file, and a
+table run keeps it in job_state in the same transaction as the COPY.
+
+Unlike the live endpoint, every eligible meal is ranked, not only the ten
+best rated, and the per-user factorization blend is not applied.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from allergens import allergy_mask, meal_allergen_mask
+from catalog import to_meal_dict
+from database import Database
+from models import preference_signature
+from recommender import MealRecommender
+from synthetic import generate_meals, generate_user_preferences
+
+JOB_NAME = 'batch_recommendations'
+
+
+class CatalogScorer:
+    """Ranks the catalog for a preference signature with array operations"""
+
+    def __init__(self, meals, top_n=10, recommender=None):
+        recommender = recommender or MealRecommender()
+        self.top_n = top_n
+        self.meal_ids = np.array([meal['id'] for meal in meals], dtype=np.int64)
+        self.diets = np.array([meal.get('diet_type') for meal in meals], dtype=object)
+        self.cuisines = np.array([meal.get('cuisine_type') for meal in meals], dtype=object)
+        self.allergens = np.array([
+            meal_allergen_mask(meal.get('ingredients')) if meal.get('allergen_mask') is None else meal['allergen_mask']
+            for meal in meals
+        ], dtype=np.int64)
+        self.ingredients = [frozenset(meal.get('ingredients') or []) for meal in meals]
+        self.scores = {
+            goal: np.array([recommender.score_meal(meal, goal) for meal in meals], dtype=np.float64)
+            for goal in recommender.GOAL_WEIGHTS
+        }
+
+    def rank(self, signature):
+        """(meal_ids, scores) of the best meals for a signature, best first"""
+        diet_type, preferences, allergies, health_goal = signature
+        eligible = np.ones(len(self.meal_ids), dtype=bool)
+        # Same filters as Database.get_meals_by_preferences
+        if diet_type != 'any':
+            eligible &= self.diets == diet_type
+        if preferences:
+            eligible &= np.isin(self.cuisines, list(preferences))
+        excluded_mask, unmatched = allergy_mask(list(allergies))
+        if excluded_mask:
+            eligible &= (self.allergens & excluded_mask) == 0
+        for allergy in unmatched:
+            eligible &= np.fromiter((allergy not in ingredients for ingredients in self.ingredients),
+                                    dtype=bool, count=len(self.ingredients))
+
+        rows = np.flatnonzero(eligible)
+        scores = self.scores.get(health_goal, self.scores['maintain'])[rows]
+        if len(rows) > self.top_n:
+            best = np.argpartition(-scores, self.top_n - 1)[:self.top_n]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return self.meal_ids[rows[order]].tolist(), np.round(scores[order], 2).tolist()
+
+
+# Per-process state set up once by the pool initializer
+_scorer = None
+_output = None
+_catalog_version = None
+_ranked = {}
+_MAX_CACHED_SIGNATURES = 100000
+
+
+def _init_worker(meals, top_n, output, catalog_version):
+    global _scorer, _output, _catalog_version
+    _scorer = CatalogScorer(meals, top_n)
+    _output = output
+    _catalog_version = catalog_version
+
+
+def _formatted(signature):
+    """Ranking of a signature pre-rendered in the output format"""
+    result = _ranked.get(signature)
+    if result is None:
+        if len(_ranked) >= _MAX_CACHED_SIGNATURES:
+            _ranked.clear()
+        meal_ids, scores = _scorer.rank(signature)
+        if _output == 'jsonl':
+            result = f'"meal_ids": {json.dumps(meal_ids)}, "scores": {json.dumps(scores)}}}\n'
+        else:
+            version = '\\N' if _catalog_version is None else _catalog_version
+            result = (f"\t{{{','.join(map(str, meal_ids))}}}"
+                      f"\t{{{','.join(map(str, scores))}}}\t{version}\n")
+        _ranked[signature] = result
+    return result
+
+
+def score_chunk(users):
+    """Score one chunk of preference rows; returns (last_user_id, users, signatures, payload)"""
+    groups = {}
+    for user in users:
+        signature = preference_signature(user['diet_type'], user['preferences'], user['allergies'], user['health_goal'])
+        groups.setdefault(signature, []).append(user['user_id'])
+    lines = {}
+    for signature, user_ids in groups.items():
+        suffix = _formatted(signature)
+        for user_id in user_ids:
+            lines[user_id] = f'{{"user_id": {user_id}, {suffix}' if _output == 'jsonl' else f"{user_id}{suffix}"
+    # Keep user_id order so the last written id is a valid checkpoint
+    payload = ''.join(lines[user['user_id']] for user in users)
+    return users[-1]['user_id'], len(users), len(groups), payload
+
+
+def score_synthetic_chunk(start_id, count, seed):
+    """Generate synthetic users inside the worker and score them"""
+    return score_chunk(list(generate_user_preferences(count, seed, start_id)))
+
+
+class JsonlWriter:
+    """Appends chunks to a JSONL file with a sidecar checkpoint"""
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.checkpoint_path = f"{path}.checkpoint"
+        self.last_user_id = 0
+        offset = 0
+        if resume and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+            self.last_user_id, offset = checkpoint['last_user_id'], checkpoint['offset']
+        self.file = open(path, 'a' if offset else 'w')
+        # Drop anything written after the last checkpoint
+        self.file.truncate(offset)
+
+    def write(self, last_user_id, payload):
+        self.file.write(payload)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_user_id = last_user_id
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'last_user_id': last_user_id, 'offset': self.file.tell()}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def close(self):
+        self.file.close()
+
+
+class TableWriter:
+    """COPYs chunks into user_recommendations, checkpointing in job_state"""
+
+    def __init__(self, db, resume=False):
+        self.db = db
+        self.last_user_id = db.get_job_state(JOB_NAME) if resume else 0
+
+    def write(self, last_user_id, payload):
+        with self.db.get_cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS user_recommendations_stage
+                (LIKE user_recommendations INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+            """)
+            cur.copy_expert("COPY user_recommendations_stage (user_id, meal_ids, scores, catalog_version) FROM STDIN",
+                            io.StringIO(payload))
+            cur.execute("""
+                INSERT INTO user_recommendations (user_id, meal_ids, scores, catalog_version)
+                SELECT user_id, meal_ids, scores, catalog_version FROM user_recommendations_stage
+                ON CONFLICT (user_id) DO UPDATE SET
+                    meal_ids = EXCLUDED.meal_ids,
+                    scores = EXCLUDED.scores,
+                    catalog_version = EXCLUDED.catalog_version,
+                    generated_at = CURRENT_TIMESTAMP
+            """)
+            self.db.set_job_state(JOB_NAME, last_user_id, cur)
+        self.last_user_id = last_user_id
+
+    def close(self):
+        pass
+
+
+class BatchRecommendationJob:
+    """Streams users through a process pool and writes results in order"""
+
+    def __init__(self, meals, writer, output, workers=None, chunk_size=20000, top_n=10, catalog_version=None):
+        self.meals = meals
+        self.writer = writer
+        self.output = output
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.top_n = top_n
+        self.catalog_version = catalog_version
+
+    def run(self, tasks, task_fn):
+        """Submit `tasks` to `task_fn` keeping a bounded window in flight"""
+        started = time.time()
+        users = signatures = chunks = 0
+        with ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                 initargs=(self.meals, self.top_n, self.output, self.catalog_version)) as pool:
+            pending = deque()
+
+            def drain_one():
+                nonlocal users, signatures, chunks
+                last_user_id, count, groups, payload = pending.popleft().result()
+                self.writer.write(last_user_id, payload)
+                users += count
+                signatures += groups
+                chunks += 1
+                if chunks % 10 == 0:
+                    elapsed = time.time() - started
+                    print(f"{users} users through user_id {last_user_id} ({users / elapsed:,.0f} users/s)")
+
+            for task in tasks:
+                pending.append(pool.submit(task_fn, *task))
+                if len(pending) >= self.workers * 2:
+                    drain_one()
+            while pending:
+                drain_one()
+        self.writer.close()
+
+        elapsed = time.time() - started
+        report = {
+            'users': users,
+            'chunks': chunks,
+            'signature_groups': signatures,
+            'users_per_group': round(users / signatures, 1) if signatures else 0,
+            'workers': self.workers,
+            'seconds': round(elapsed, 2),
+            'users_per_second': round(users / elapsed) if elapsed else 0
+        }
+        print(json.dumps(report))
+        return report
+
+
+def database_tasks(db, after_user_id, chunk_size):
+    for rows in db.iter_user_preferences(after_user_id, chunk_size):
+        yield ([dict(row) for row in rows],)
+
+
+def synthetic_tasks(total, after_user_id, chunk_size, seed):
+    for start_id in range(after_user_id + 1, total + 1, chunk_size):
+        yield start_id, min(chunk_size, total + 1 - start_id), seed
+
+
+def load_catalog(db):
+    """Live catalog version with feedback-adjusted ratings"""
+    with db.get_cursor() as cur:
+        cur.execute("SELECT active_version FROM catalog_state")
+        version = cur.fetchone()['active_version']
+        cur.execute("""
+            SELECT meals.*, COALESCE(agg.score, meals.rating) AS feedback_score
+            FROM meals
+            LEFT JOIN meal_rating_aggregates agg ON agg.meal_key = meals.meal_key
+            WHERE meals.catalog_version = %s
+        """, (version,))
+        meals = [to_meal_dict(row) for row in cur.fetchall()]
+    for meal in meals:
+        if meal.get('feedback_score') is not None:
+            meal['feedback_score'] = float(meal['feedback_score'])
+    return meals, version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score recommendations for every user with saved preferences")
+    parser.add_argument('--output', choices=['jsonl', 'table'], default='jsonl')
+    parser.add_argument('--path', default='recommendations.jsonl')
+    parser.add_argument('--resume', action='store_true', help="continue after the last checkpoint")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=20000)
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--synthetic-users', type=int, default=0,
+                        help="score this many generated users against a generated catalog")
+    parser.add_argument('--synthetic-meals', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    if args.synthetic_users:
+        if args.output != 'jsonl':
+            parser.error("synthetic users can only be written to jsonl")
+        meals, version, db = generate_meals(args.synthetic_meals), None, None
+    else:
+        db = Database()
+        meals, version = load_catalog(db)
+        if not meals:
+            print("No meals in the active catalog")
+            return 1
+
+    writer = JsonlWriter(args.path, args.resume) if args.output == 'jsonl' else TableWriter(db, args.resume)
+    if writer.last_user_id:
+        print(f"Resuming after user_id {writer.last_user_id}")
+    job = BatchRecommendationJob(meals, writer, args.output, args.workers, args.chunk_size, args.top_n, version)
+    if args.synthetic_users:
+        job.run(synthetic_tasks(args.synthetic_users, writer.last_user_id, args.chunk_size, args.seed),
+                score_synthetic_chunk)
+    else:
+        job.run(database_tasks(db, writer.last_user_id, args.chunk_size), score_chunk)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""Core scaling benchmark for the batch recommendation job.
+
+Usage: python benchmarks/bench_batch_recommendations.py [--users 200000] [--meals 5000] [--workers 1,2,4,8]
+
+Runs the same path as a database run: the parent streams chunks of
+preference rows shaped like user_preferences rows, workers score them with
+score_chunk and the parent writes every chunk to a JSONL file with its
+checkpoint. Rows are generated before timing starts, so only pickling,
+scoring and writing are measured. Prints throughput with speedup and
+efficiency relative to the smallest worker count.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_recommendations import BatchRecommendationJob, JsonlWriter, score_chunk
+from synthetic import generate_meals, generate_user_preferences
+
+
+def preference_chunks(total, chunk_size, seed):
+    """Chunks of row dicts, as database_tasks hands them to the pool"""
+    return [[dict(row) for row in generate_user_preferences(min(chunk_size, total + 1 - start_id), seed, start_id)]
+            for start_id in range(1, total + 1, chunk_size)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--meals', type=int, default=5000)
+    parser.add_argument('--chunk-size', type=int, default=20000)
+    parser.add_argument('--workers', default=None, help="comma-separated worker counts")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    counts = [int(n) for n in args.workers.split(',')] if args.workers else \
+        sorted({1, 2, 4, 8, 16, cores} & set(range(1, cores + 1)))
+    meals = generate_meals(args.meals)
+    chunks = preference_chunks(args.users, args.chunk_size, 7)
+
+    baseline = None
+    print(f"{args.users} users, {args.meals} meals, {cores} cores")
+    with tempfile.TemporaryDirectory() as directory:
+        for workers in counts:
+            writer = JsonlWriter(os.path.join(directory, f"recommendations-{workers}.jsonl"))
+            job = BatchRecommendationJob(meals, writer, 'jsonl', workers, args.chunk_size)
+            report = job.run(((rows,) for rows in chunks), score_chunk)
+            baseline = baseline or report['users_per_second']
+            speedup = report['users_per_second'] / baseline
+            print(f"workers={workers:<3} {report['users_per_second']:>10,} users/s  "
+                  f"speedup {speedup:.2f}x  efficiency {speedup * counts[0] / workers:.0%}")
+
+
+if __name__ == '__main__':
+    main()
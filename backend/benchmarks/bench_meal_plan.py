@@ -0,0 +1,72 @@
+"""Latency and quality benchmark for the weekly meal-plan solver.
+
+Usage: python benchmarks/bench_meal_plan.py [--sizes 1000,10000,50000,100000] [--runs 50] [--budget-ms 100]
+Exits non-zero when p99 latency at any size up to 50k candidates exceeds the budget.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from meal_planner import MealPlanner, MealPlanError
+from models import UserPreferences
+from recommender import MealRecommender
+from synthetic import generate_meals, CUISINES
+
+GOALS = ['lose', 'maintain', 'gain', 'energy', 'muscle']
+ALLERGY_SETS = [[], [], ['peanut'], ['dairy'], ['gluten'], ['shellfish', 'fish']]
+# "any" keeps the full catalog as candidates, which is the worst case for the solver
+DIETS = ['any', 'any', 'any', 'vegetarian']
+ENFORCED_MAX_SIZE = 50000
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,50000,100000')
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--budget-ms', type=float, default=100.0)
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    recommender = MealRecommender.__new__(MealRecommender)  # scoring only, no database needed
+    ok = True
+    for size in (int(s) for s in args.sizes.split(',')):
+        planner = MealPlanner(recommender, time_budget_ms=args.budget_ms)
+        started = time.perf_counter()
+        planner.load(generate_meals(size))
+        load_s = time.perf_counter() - started
+
+        latencies, deviations, failures = [], [], 0
+        for _ in range(args.runs):
+            prefs = UserPreferences(rng.choice(DIETS), rng.sample(CUISINES, rng.randint(0, 2)),
+                                    rng.choice(ALLERGY_SETS), rng.choice(GOALS))
+            started = time.perf_counter()
+            try:
+                plan = planner.plan(prefs, seed=rng.random())
+            except MealPlanError:
+                failures += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+            deviations.append(plan['average_calorie_deviation'])
+
+        p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+        within = p99 <= args.budget_ms
+        if size <= ENFORCED_MAX_SIZE:
+            ok = ok and within
+        print(f"{size:>7} meals  load={load_s:5.1f}s  p50={p50:6.1f}ms  p99={p99:6.1f}ms  "
+              f"max={max(latencies):6.1f}ms  calorie_dev={sum(deviations) / len(deviations):.2%}  "
+              f"infeasible={failures}  {'OK' if within else 'OVER BUDGET'}")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
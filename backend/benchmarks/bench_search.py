@@ -0,0 +1,88 @@
+"""Latency benchmark for meal search and ingredient autocomplete.
+
+Usage: python benchmarks/bench_search.py [--meals 100000] [--queries 2000] [--target-ms 5]
+Exits non-zero when the p99 latency of either endpoint exceeds the target.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import UserPreferences
+from search import MealSearchIndex, IngredientAutocomplete
+from synthetic import generate_meals, PROTEINS, VEGETABLES, DISHES, STYLES, CUISINES, DIET_TYPES
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def query_mix(rng, count):
+    words = [w.lower() for w in PROTEINS + VEGETABLES + DISHES + STYLES + CUISINES]
+    queries = []
+    for _ in range(count):
+        phrase = ' '.join(rng.sample(words, rng.randint(1, 3)))
+        # Search-as-you-type: cut the phrase at a random keystroke
+        queries.append(phrase[:rng.randint(2, len(phrase))])
+    return queries
+
+
+def preferences_mix(rng, count):
+    allergy_sets = [[], [], [], ['peanut'], ['dairy'], ['gluten', 'soy'], ['shellfish', 'fish']]
+    return [UserPreferences(rng.choice(DIET_TYPES), [], rng.choice(allergy_sets), 'maintain') for _ in range(count)]
+
+
+def time_calls(fn, args):
+    samples = []
+    for arg in args:
+        start = time.perf_counter()
+        fn(*arg)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name, samples, target_ms):
+    p50, p95, p99 = (percentile(samples, p) for p in (50, 95, 99))
+    ok = p99 <= target_ms
+    print(f"{name:<14} p50={p50:6.3f}ms p95={p95:6.3f}ms p99={p99:6.3f}ms max={max(samples):6.3f}ms "
+          f"{'OK' if ok else 'OVER TARGET'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--meals', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--target-ms', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    meals = generate_meals(args.meals)
+
+    start = time.perf_counter()
+    search_index = MealSearchIndex()
+    search_index.load(meals)
+    autocomplete = IngredientAutocomplete()
+    autocomplete.load(meals)
+    print(f"indexed {len(meals)} meals in {time.perf_counter() - start:.1f}s")
+
+    queries = query_mix(rng, args.queries)
+    prefs = preferences_mix(rng, args.queries)
+    # Untimed queries first so one-off warm-up is not measured
+    for query in queries[:200]:
+        search_index.search(query, 20)
+
+    ok = report('search', time_calls(search_index.search, [(q, 20, p) for q, p in zip(queries, prefs)]),
+                args.target_ms)
+    prefixes = [(q[:rng.randint(1, min(6, len(q)))], 10) for q in queries]
+    ok = report('autocomplete', time_calls(autocomplete.suggest, prefixes), args.target_ms) and ok
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
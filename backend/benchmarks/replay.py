@@ -0,0 +1,280 @@
+"""Replay captured traffic against the app and a local Postgres.
+
+Usage: python benchmarks/replay.py traffic.jsonl [--speedup 10] [--meals 2000] [--users 50]
+                                   [--report report.json] [--baseline baseline.json] [--threshold 10]
+
+Seeds the configured database with a synthetic catalog and users, then
+issues the captured requests through Flask's test client. Requests follow
+the capture's timing divided by --speedup, and --speedup 0 sends them as
+fast as possible. Prints per-route latency and throughput. With
+--baseline, it also prints the change against a previous --report and
+exits non-zero when a route's p95 or throughput regresses by more than
+--threshold percent.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module
+from config import Config
+from synthetic import generate_meals
+
+# Destructive or out-of-band routes that a replay must not repeat
+SKIPPED_ROUTES = {'/api/admin/reset-meals'}
+LOCAL_HOSTS = {'localhost', '127.0.0.1', '::1'}
+REPLAY_PASSWORD = 'replay-password'
+# Seconds to wait for the background load of the seeded catalog
+CATALOG_LOAD_TIMEOUT = 120
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def load_capture(path):
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    entries = [entry for entry in entries if entry['route'] not in SKIPPED_ROUTES]
+    entries.sort(key=lambda entry: entry['ts'])
+    return entries
+
+
+def stable_index(value, size):
+    return int(hashlib.sha256(str(value).encode()).hexdigest(), 16) % size
+
+
+class ReplayEnvironment:
+    """Seeded database plus the tokens and ids captured requests are mapped onto"""
+
+    def __init__(self, app_module, meals, users, seed):
+        self.app = app_module
+        self.meal_ids = []
+        self.words = []
+        self.ingredients = []
+        self.users = []
+        self._seed(meals, users, seed)
+
+    def _seed(self, meal_count, user_count, seed):
+        app_module = self.app
+        app_module.db.initialize_database()
+        app_module.db_initialized = True
+        version = app_module.db.reset_meals_data(meals=generate_meals(meal_count, seed))
+        app_module.catalog.refresh(force=True)
+        deadline = time.time() + CATALOG_LOAD_TIMEOUT
+        while (app_module.catalog.state or {}).get('version') != version:
+            if time.time() > deadline:
+                raise RuntimeError(f"Catalog version {version} was not loaded within {CATALOG_LOAD_TIMEOUT}s")
+            time.sleep(0.05)
+        self.meal_ids = sorted(app_module.catalog.meals)
+        meals = app_module.catalog.all_meals()
+        self.words = sorted({word for meal in meals for word in meal['name'].lower().split()})
+        self.ingredients = sorted({ingredient.lower() for meal in meals for ingredient in meal['ingredients'] or []})
+
+        auth_service = app_module.auth_service
+        for index in range(user_count):
+            email = f"replay-{index}@example.test"
+            auth_service.register_user(f"Replay {index}", email, REPLAY_PASSWORD)
+            user, error = auth_service.authenticate_user(email, REPLAY_PASSWORD)
+            if error:
+                raise RuntimeError(f"Cannot sign in {email}: {error}")
+            self.users.append((email, auth_service.generate_token(user.id)))
+
+        # Snapshots for the new catalog are built in the background
+        deadline = time.time() + 60
+        while app_module.materialized.snapshot()['building'] and time.time() < deadline:
+            time.sleep(0.1)
+
+    def meal_id(self, captured_id):
+        return self.meal_ids[stable_index(captured_id, len(self.meal_ids))]
+
+    def query_text(self, route, shape):
+        """Catalog text with a captured query's shape; repeats of one query
+        map to the same text"""
+        if not isinstance(shape, dict):
+            return shape
+        if not shape.get('length'):
+            return ''
+        if 'autocomplete' in route:
+            return self.ingredients[stable_index(shape['hash'], len(self.ingredients))][:shape['length']]
+        return ' '.join(self.words[stable_index(f"{shape['hash']}:{n}", len(self.words))]
+                        for n in range(max(1, shape.get('tokens', 1))))
+
+    def build_request(self, entry):
+        """(method, url, query, json body, headers) for a captured entry"""
+        view_args = dict(entry.get('view_args') or {})
+        if 'meal_id' in view_args:
+            view_args['meal_id'] = self.meal_id(view_args['meal_id'])
+        url = re.sub(r"<(?:[a-z]+:)?([a-z_]+)>", lambda m: str(view_args.get(m.group(1), '')), entry['route'])
+
+        query = dict(entry.get('query') or {})
+        query.pop('cursor', None)
+        for key in ('q', 'prefix'):
+            if key in query:
+                query[key] = self.query_text(entry['route'], query[key])
+        body = dict(entry.get('body') or {}) if entry.get('body') is not None else None
+        if body and 'meal_id' in body:
+            body['meal_id'] = self.meal_id(body['meal_id'])
+        if body is not None and 'feedback' in body:
+            body['feedback'] = 'replayed feedback' if body['feedback'] else None
+
+        email, token = self.users[stable_index(entry.get('client'), len(self.users))]
+        headers = {'Authorization': f'Bearer {token}'} if entry.get('authenticated') else {}
+        if entry['route'] == '/api/auth/login':
+            body = {'email': email, 'password': REPLAY_PASSWORD}
+        elif entry['route'] == '/api/auth/register':
+            body = {'name': 'Replay', 'email': f"replay-{uuid.uuid4().hex}@example.test",
+                    'password': REPLAY_PASSWORD}
+        return entry['method'], url, query, body, headers
+
+
+def replay(app_module, environment, entries, speedup, concurrency):
+    """Send entries on the captured schedule; returns per-request results and wall time.
+
+    A request that raises instead of returning a response is recorded with
+    status None and counted as an error.
+    """
+    results = []
+    results_lock = threading.Lock()
+    local = threading.local()
+
+    def send(entry, request_args):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = app_module.app.test_client()
+        method, url, query, body, headers = request_args
+        status = None
+        start = time.perf_counter()
+        try:
+            response = client.open(url, method=method, query_string=query, json=body, headers=headers)
+            # Drain streamed responses so their cost is included
+            response.get_data()
+            status = response.status_code
+        finally:
+            latency_ms = (time.perf_counter() - start) * 1000
+            with results_lock:
+                results.append((f"{entry['method']} {entry['route']}", status, latency_ms))
+
+    first_ts = entries[0]['ts'] if entries else 0
+    started = time.perf_counter()
+    futures = []
+    with ThreadPoolExecutor(concurrency) as pool:
+        for entry in entries:
+            if speedup > 0:
+                delay = (entry['ts'] - first_ts) / speedup - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(pool.submit(send, entry, environment.build_request(entry)))
+    wall_seconds = time.perf_counter() - started
+
+    failures = [future.exception() for future in futures if future.exception() is not None]
+    if failures:
+        print(f"{len(failures)} requests raised, first: {failures[0]!r}", file=sys.stderr)
+    return results, wall_seconds
+
+
+def summarize(results, wall_seconds):
+    by_route = {}
+    for route, status, latency_ms in results:
+        by_route.setdefault(route, []).append((status, latency_ms))
+    report = {'wall_seconds': round(wall_seconds, 3), 'requests': len(results), 'routes': {}}
+    for route, samples in sorted(by_route.items()):
+        latencies = [latency for _, latency in samples]
+        statuses = {}
+        for status, _ in samples:
+            key = 'exception' if status is None else str(status)
+            statuses[key] = statuses.get(key, 0) + 1
+        report['routes'][route] = {
+            'count': len(samples),
+            'throughput_rps': round(len(samples) / wall_seconds, 2) if wall_seconds else 0,
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'errors': sum(1 for status, _ in samples if status is None or status >= 500),
+            'statuses': statuses
+        }
+    return report
+
+
+def print_report(report, baseline=None, threshold=10.0):
+    """Print the per-route table; returns the routes that regressed against the baseline"""
+    regressions = []
+    print(f"{report['requests']} requests in {report['wall_seconds']:.1f}s")
+    for route, stats in report['routes'].items():
+        line = (f"{route:<45} n={stats['count']:<6} {stats['throughput_rps']:8.2f} rps "
+                f"p50={stats['p50_ms']:8.2f}ms p95={stats['p95_ms']:8.2f}ms p99={stats['p99_ms']:8.2f}ms "
+                f"errors={stats['errors']}")
+        previous = (baseline or {}).get('routes', {}).get(route)
+        if previous:
+            p95_change = _change(previous['p95_ms'], stats['p95_ms'])
+            rps_change = _change(previous['throughput_rps'], stats['throughput_rps'])
+            line += f"  p95 {p95_change:+.1f}% rps {rps_change:+.1f}%"
+            if p95_change > threshold or rps_change < -threshold:
+                regressions.append(route)
+                line += "  REGRESSION"
+        elif baseline:
+            line += "  (new route)"
+        print(line)
+    return regressions
+
+
+def _change(before, after):
+    return (after - before) / before * 100 if before else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('capture')
+    parser.add_argument('--speedup', type=float, default=1.0)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--meals', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--report', help="write the report as JSON")
+    parser.add_argument('--baseline', help="compare against a previous --report")
+    parser.add_argument('--threshold', type=float, default=10.0, help="regression threshold in percent")
+    parser.add_argument('--rate-limits', action='store_true',
+                        help="keep admission control on (all replayed requests share one client address)")
+    parser.add_argument('--allow-remote-db', action='store_true')
+    args = parser.parse_args()
+
+    config = Config()
+    if config.DB_HOST not in LOCAL_HOSTS and not args.allow_remote_db:
+        parser.error(f"refusing to seed non-local database host {config.DB_HOST!r}")
+
+    entries = load_capture(args.capture)
+    if not entries:
+        parser.error("capture has no replayable requests")
+
+    app_module.traffic_recorder = None
+    app_module.admission.enabled = args.rate_limits
+
+    environment = ReplayEnvironment(app_module, args.meals, args.users, args.seed)
+    results, wall_seconds = replay(app_module, environment, entries, args.speedup, args.concurrency)
+    report = summarize(results, wall_seconds)
+    report['settings'] = {'speedup': args.speedup, 'concurrency': args.concurrency,
+                          'meals': args.meals, 'users': args.users}
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = print_report(report, baseline, args.threshold)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import threading
+import time
+import decimal
+from database import Database
+
+
+class MealCatalog:
+    """In-process copy of the meals table shared by the in-memory indexes.
+
+    Listeners get `load(meals)` after a full reload and `add(meals)` when only
+    new meals were appended, so they can update incrementally. When a new
+    catalog version is activated the reload runs in a background thread and
+    readers keep the previous snapshot until it finishes. `start()` moves
+    the periodic checks off the request path; requests only read `ready`.
+    """
+
+    def __init__(self, db=None, refresh_interval=30):
+        self.db = db or Database()
+        self.refresh_interval = refresh_interval
+        self.meals = {}
+        self.state = None
+        self._listeners = []
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._reloading = False
+        self._refresher = None
+
+    @property
+    def ready(self):
+        """True once the first load has reached every listener"""
+        return self.state is not None
+
+    def start(self):
+        """Load and then keep refreshing the catalog from a daemon thread"""
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing meal catalog: {e}")
+            # Retry a failed first load sooner than a routine check
+            time.sleep(self.refresh_interval if self.ready else min(self.refresh_interval, 5))
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+        if self.meals:
+            listener.load(list(self.meals.values()))
+
+    def refresh(self, force=False):
+        """Reload from the database if the catalog changed since the last check"""
+        now = time.monotonic()
+        if not force and self.state is not None and now - self._checked_at < self.refresh_interval:
+            return False
+        with self._lock:
+            if not force and self.state is not None and now - self._checked_at < self.refresh_interval:
+                return False
+            self._checked_at = now
+            state = dict(self.db.get_catalog_state())
+            if state == self.state and not force:
+                return False
+
+            if self.state is not None and state.get('version') != self.state.get('version'):
+                self._start_reload(state)
+                return True
+
+            if self.state is not None and not force and state['max_id'] > self.state['max_id']:
+                new_meals = [to_meal_dict(row) for row in
+                             self.db.get_all_meals(self.state['max_id'], state.get('version'))]
+                if self.state['count'] + len(new_meals) == state['count']:
+                    self._add(new_meals)
+                    self.state = state
+                    return True
+
+            self._load([to_meal_dict(row) for row in self.db.get_all_meals(0, state.get('version'))])
+            self.state = state
+            return True
+
+    def _start_reload(self, state):
+        """Swap to a new catalog version without blocking requests"""
+        if self._reloading:
+            return
+        self._reloading = True
+        threading.Thread(target=self._reload, args=(state,), daemon=True).start()
+
+    def _reload(self, state):
+        try:
+            meals = [to_meal_dict(row) for row in self.db.get_all_meals(0, state.get('version'))]
+            # Listeners build their new index before swapping it in, so the
+            # catalog lock is only held for the final switch
+            for listener in self._listeners:
+                listener.load(meals)
+            with self._lock:
+                self.meals = {meal['id']: meal for meal in meals}
+                self.state = state
+        except Exception as e:
+            print(f"Error reloading catalog version {state.get('version')}: {e}")
+        finally:
+            self._reloading = False
+
+    def _load(self, meals):
+        self.meals = {meal['id']: meal for meal in meals}
+        for listener in self._listeners:
+            listener.load(meals)
+
+    def _add(self, meals):
+        updated = dict(self.meals)
+        updated.update((meal['id'], meal) for meal in meals)
+        self.meals = updated
+        for listener in self._listeners:
+            listener.add(meals)
+
+    def get(self, meal_id):
+        return self.meals.get(meal_id)
+
+    def all_meals(self):
+        return list(self.meals.values())
+
+
+def to_meal_dict(row):
+    """Copy a meals row into a plain dict with JSON- and math-friendly types"""
+    meal = dict(row)
+    for key in ('rating', 'calories'):
+        if isinstance(meal.get(key), decimal.Decimal):
+            meal[key] = float(meal[key])
+    return meal
@@ -31,3 +31,45 @@ class Config:
     # App config
     DEBUG = os.getenv("DEBUG", "False").lower() == "true"
     SECRET_KEY = os.getenv("SECRET_KEY", "dev-secret-key-change-in-production")
+
+    # Latency budget for a whole meal-plan call; the greedy pass and the
+    # local search both stop at it
+    PLAN_TIME_BUDGET_MS = float(os.getenv("PLAN_TIME_BUDGET_MS", "100"))
+
+    # Admission control
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "True").lower() == "true"
+    # "memory" keeps limiter state per process, "shared" uses a shared key-value store
+    RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    RECOMMENDATIONS_RATE = float(os.getenv("RECOMMENDATIONS_RATE", "2"))
+    RECOMMENDATIONS_BURST = int(os.getenv("RECOMMENDATIONS_BURST", "10"))
+    RECOMMENDATIONS_MAX_IN_FLIGHT = int(os.getenv("RECOMMENDATIONS_MAX_IN_FLIGHT", "16"))
+    # Search is called per keystroke, so it gets a larger budget
+    SEARCH_RATE = float(os.getenv("SEARCH_RATE", "10"))
+    SEARCH_BURST = int(os.getenv("SEARCH_BURST", "30"))
+    AUTH_RATE = float(os.getenv("AUTH_RATE", "0.2"))
+    AUTH_BURST = int(os.getenv("AUTH_BURST", "5"))
+    AUTH_MAX_IN_FLIGHT = int(os.getenv("AUTH_MAX_IN_FLIGHT", "4"))
+    SHED_TARGET_DELAY_MS = float(os.getenv("SHED_TARGET_DELAY_MS", "5"))
+    SHED_INTERVAL_MS = float(os.getenv("SHED_INTERVAL_MS", "100"))
+    # Number of reverse proxies in front of the app whose X-Forwarded-For is trusted
+    TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", "0"))
+    # Token buckets keyed on the client address. Behind a proxy every caller
+    # shares the proxy's address until TRUSTED_PROXY_COUNT is set, so they are
+    # off by default then; set to true when clients connect directly.
+    RATE_LIMIT_BY_ADDRESS = os.getenv("RATE_LIMIT_BY_ADDRESS", str(TRUSTED_PROXY_COUNT > 0)).lower() == "true"
+    EXPORT_RATE = float(os.getenv("EXPORT_RATE", "0.05"))
+    EXPORT_BURST = int(os.getenv("EXPORT_BURST", "2"))
+
+    # Precomputed recommendations for the most common preference buckets
+    MATERIALIZED_BUCKETS = int(os.getenv("MATERIALIZED_BUCKETS", "200"))
+    MATERIALIZED_MIN_USERS = int(os.getenv("MATERIALIZED_MIN_USERS", "2"))
+
+    # Sanitized request capture for benchmarks/replay.py
+    TRAFFIC_CAPTURE_ENABLED = os.getenv("TRAFFIC_CAPTURE_ENABLED", "False").lower() == "true"
+    TRAFFIC_CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH", "traffic.jsonl")
+    TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "1.0"))
+
+    # History paging and export
+    HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+    HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "100"))
+    EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "500"))
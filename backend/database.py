@@ -1,9 +1,19 @@
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_batch, execute_values
 from contextlib import contextmanager
 from config import Config
+from allergens import TAXONOMY_VERSION, meal_allergen_mask, allergy_mask
+from nutrition import NUTRITION_VERSION, macro_rows
+from models import parse_preference_list
 import datetime
-import json
+
+# Live-version id of the meal with the same meal_key as the %s meal id
+LIVE_MEAL_ID_SQL = """
+    SELECT live.id FROM meals m
+    JOIN meals live ON live.meal_key = m.meal_key
+     AND live.catalog_version = (SELECT active_version FROM catalog_state)
+    WHERE m.id = %s
+"""
 
 class Database:
     def __init__(self):
@@ -47,27 +57,7 @@ class Database:
     
     def _format_array_param(self, param):
         """Format parameter for PostgreSQL array handling"""
-        if param is None:
-            return []
-        elif isinstance(param, str):
-            try:
-                # Try to parse as JSON array first
-                if param.strip().startswith('[') and param.strip().endswith(']'):
-                    return json.loads(param)
-            except json.JSONDecodeError:
-                pass
-            
-            # Convert string to array if it contains commas
-            if ',' in param:
-                return [item.strip() for item in param.split(',') if item.strip()]
-            elif param.strip():
-                return [param.strip()]
-            else:
-                return []
-        elif isinstance(param, list):
-            return param
-        else:
-            return []
+        return parse_preference_list(param)
     
     def initialize_database(self):
         """Initialize the database with required tables"""
@@ -102,6 +92,76 @@ class Database:
                 )
             """)
             
+            # Allergen groups per meal, precomputed from ingredients at ingest
+            cur.execute("""
+                ALTER TABLE meals
+                    ADD COLUMN IF NOT EXISTS allergen_mask INTEGER NOT NULL DEFAULT 0,
+                    ADD COLUMN IF NOT EXISTS allergen_version SMALLINT
+            """)
+            
+            # Estimated macros per meal, filled in by nutrition.py at ingest
+            cur.execute("""
+                ALTER TABLE meals
+                    ADD COLUMN IF NOT EXISTS protein_g REAL,
+                    ADD COLUMN IF NOT EXISTS carbs_g REAL,
+                    ADD COLUMN IF NOT EXISTS fat_g REAL,
+                    ADD COLUMN IF NOT EXISTS fiber_g REAL,
+                    ADD COLUMN IF NOT EXISTS nutrition_version SMALLINT
+            """)
+            
+            # Catalog versions: a reload bulk-loads a new version next to the
+            # live one and readers switch by following catalog_state
+            cur.execute("""
+                ALTER TABLE meals ADD COLUMN IF NOT EXISTS catalog_version INTEGER NOT NULL DEFAULT 1
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_meals_catalog_version ON meals (catalog_version, diet_type)
+            """)
+            # Ids are per version; meal_key names the same meal across versions
+            # so ratings and factors derived from feedback carry over on activation
+            cur.execute("ALTER TABLE meals ADD COLUMN IF NOT EXISTS meal_key VARCHAR(255)")
+            cur.execute("""
+                UPDATE meals m SET meal_key = k.meal_key
+                FROM (
+                    SELECT id, name_key || CASE WHEN n > 1 THEN '#' || n ELSE '' END AS meal_key
+                    FROM (
+                        SELECT id, name_key,
+                               row_number() OVER (PARTITION BY catalog_version, name_key ORDER BY id) AS n
+                        FROM (
+                            SELECT id, catalog_version,
+                                   lower(regexp_replace(trim(name), '[[:space:]]+', ' ', 'g')) AS name_key
+                            FROM meals
+                        ) named
+                    ) numbered
+                ) k
+                WHERE m.id = k.id AND m.meal_key IS NULL
+            """)
+            cur.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_meals_catalog_key ON meals (catalog_version, meal_key)
+            """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS catalog_versions (
+                    version SERIAL PRIMARY KEY,
+                    status VARCHAR(20) NOT NULL DEFAULT 'building',
+                    meal_count INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    activated_at TIMESTAMP
+                )
+            """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS catalog_state (
+                    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                    active_version INTEGER NOT NULL
+                )
+            """)
+            cur.execute("SELECT COUNT(*) FROM catalog_versions")
+            if cur.fetchone()['count'] == 0:
+                cur.execute("""
+                    INSERT INTO catalog_versions (status, activated_at)
+                    VALUES ('active', CURRENT_TIMESTAMP)
+                """)
+            cur.execute("INSERT INTO catalog_state (active_version) VALUES (1) ON CONFLICT (id) DO NOTHING")
+            
             # Create user_preferences table
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS user_preferences (
@@ -122,6 +182,7 @@ class Database:
                     id SERIAL PRIMARY KEY,
                     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
                     meal_id INTEGER REFERENCES meals(id),
+                    meal_key VARCHAR(255),
                     liked BOOLEAN,
                     feedback TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -134,16 +195,168 @@ class Database:
                     id SERIAL PRIMARY KEY,
                     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
                     meal_id INTEGER REFERENCES meals(id),
+                    meal_key VARCHAR(255),
                     viewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
             
+            # Feedback and history keep the id the user saw; meal_key follows
+            # the meal into later catalog versions for everything derived
+            for table in ('meal_feedback', 'meal_history'):
+                if not self._has_column(cur, table, 'meal_key'):
+                    cur.execute(f"ALTER TABLE {table} ADD COLUMN meal_key VARCHAR(255)")
+                    cur.execute(f"""
+                        UPDATE {table} t SET meal_key = m.meal_key
+                        FROM meals m WHERE m.id = t.meal_id
+                    """)
+            
+            # Keyset pagination and export scan a single user's rows in order
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_meal_history_user_viewed
+                ON meal_history (user_id, viewed_at DESC, id DESC)
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_meal_feedback_user ON meal_feedback (user_id, id)
+            """)
+            
+            # Progress markers for batch jobs that consume tables incrementally
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS job_state (
+                    name VARCHAR(50) PRIMARY KEY,
+                    high_water_mark BIGINT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Derived tables used to be keyed on per-version meal ids; they are
+            # rebuilt by their jobs, so drop the old shape and reset progress
+            if self._has_column(cur, 'meal_rating_aggregates', 'meal_id'):
+                cur.execute("DROP TABLE IF EXISTS meal_rating_aggregates, meal_feedback_gaps")
+                cur.execute("DELETE FROM job_state WHERE name = 'meal_ratings'")
+            if self._has_column(cur, 'meal_factors', 'meal_id'):
+                cur.execute("DROP TABLE IF EXISTS meal_factors, user_top_meals")
+                cur.execute("DELETE FROM job_state WHERE name = 'factorization'")
+            
+            # Matrix factorization output written by factorization.py
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS user_factors (
+                    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+                    factors REAL[] NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS meal_factors (
+                    meal_key VARCHAR(255) PRIMARY KEY,
+                    factors REAL[] NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS user_top_meals (
+                    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+                    meal_keys VARCHAR(255)[] NOT NULL,
+                    scores REAL[] NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Ranked results per common preference bucket, see materialized.py
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS recommendation_snapshots (
+                    catalog_version INTEGER NOT NULL,
+                    diet_type VARCHAR(50) NOT NULL,
+                    preferences TEXT[] NOT NULL,
+                    allergies TEXT[] NOT NULL,
+                    health_goal VARCHAR(50) NOT NULL,
+                    user_count INTEGER NOT NULL,
+                    results JSONB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (catalog_version, diet_type, preferences, allergies, health_goal)
+                )
+            """)
+            # What a snapshot was ranked against: the rating aggregator's
+            # high-water mark and the newest meal of its version
+            cur.execute("""
+                ALTER TABLE recommendation_snapshots
+                    ADD COLUMN IF NOT EXISTS ratings_mark BIGINT NOT NULL DEFAULT 0,
+                    ADD COLUMN IF NOT EXISTS max_meal_id INTEGER NOT NULL DEFAULT 0
+            """)
+            
+            # Weekly suggestions written by batch_recommendations.py
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS user_recommendations (
+                    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+                    meal_ids INTEGER[] NOT NULL,
+                    scores REAL[] NOT NULL,
+                    catalog_version INTEGER,
+                    generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Running feedback counts per meal, maintained by meal_ratings.py
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS meal_rating_aggregates (
+                    meal_key VARCHAR(255) PRIMARY KEY,
+                    likes INTEGER NOT NULL DEFAULT 0,
+                    dislikes INTEGER NOT NULL DEFAULT 0,
+                    score DOUBLE PRECISION,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # Feedback ids below the high-water mark that were not visible yet
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS meal_feedback_gaps (
+                    id INTEGER PRIMARY KEY,
+                    seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
             # Insert sample data if table is empty
             cur.execute("SELECT COUNT(*) FROM meals")
             if cur.fetchone()['count'] == 0:
-                self.insert_sample_data(cur)
+                cur.execute("SELECT active_version FROM catalog_state")
+                self.insert_sample_data(cur, cur.fetchone()['active_version'])
+            
+            self.backfill_allergen_masks(cur)
+            self.backfill_nutrition(cur)
     
-    def insert_sample_data(self, cur):
+    def _has_column(self, cur, table, column):
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s
+        """, (table, column))
+        return cur.fetchone() is not None
+    
+    def backfill_allergen_masks(self, cur):
+        """Recompute allergen masks for meals tagged with an older taxonomy"""
+        cur.execute("""
+            SELECT id, ingredients FROM meals
+            WHERE allergen_version IS DISTINCT FROM %s
+        """, (TAXONOMY_VERSION,))
+        rows = [(meal_allergen_mask(row['ingredients']), TAXONOMY_VERSION, row['id']) for row in cur.fetchall()]
+        if rows:
+            execute_batch(cur, """
+                UPDATE meals SET allergen_mask = %s, allergen_version = %s WHERE id = %s
+            """, rows)
+        return len(rows)
+    
+    def backfill_nutrition(self, cur):
+        """Recompute macros for meals estimated with an older nutrition table"""
+        cur.execute("""
+            SELECT id, ingredients, calories FROM meals
+            WHERE nutrition_version IS DISTINCT FROM %s
+        """, (NUTRITION_VERSION,))
+        meals = cur.fetchall()
+        rows = [(*macros, NUTRITION_VERSION, meal['id']) for meal, macros in zip(meals, macro_rows(meals))]
+        if rows:
+            execute_batch(cur, """
+                UPDATE meals SET protein_g = %s, carbs_g = %s, fat_g = %s, fiber_g = %s, nutrition_version = %s
+                WHERE id = %s
+            """, rows)
+        return len(rows)
+    
+    def insert_sample_data(self, cur, catalog_version=1):
         """Insert sample meal data with proper image URLs"""
         sample_meals = [
             {
@@ -208,14 +421,37 @@ class Database:
             }
         ]
         
-        for meal in sample_meals:
-            cur.execute("""
-                INSERT INTO meals (name, description, image_url, calories, prep_time, rating, 
-                                diet_type, cuisine_type, ingredients, health_benefits)
-                VALUES (%(name)s, %(description)s, %(image_url)s, %(calories)s, %(prep_time)s, 
-                        %(rating)s, %(diet_type)s, %(cuisine_type)s, %(ingredients)s, %(health_benefits)s)
-            """, meal)
-        
+        return self.bulk_insert_meals(cur, sample_meals, catalog_version)
+    
+    def bulk_insert_meals(self, cur, meals, catalog_version):
+        """Insert meals into a catalog version with derived columns filled in"""
+        rows = [(
+            meal['name'], meal.get('description'), meal.get('image_url'), meal.get('calories'),
+            meal.get('prep_time'), meal.get('rating'), meal.get('diet_type'), meal.get('cuisine_type'),
+            meal.get('ingredients') or [], meal.get('health_benefits') or [],
+            meal_allergen_mask(meal.get('ingredients')), TAXONOMY_VERSION,
+            *macros, NUTRITION_VERSION, catalog_version, meal_key
+        ) for meal, macros, meal_key in zip(meals, macro_rows(meals), self._meal_keys(meals))]
+        execute_values(cur, """
+            INSERT INTO meals (name, description, image_url, calories, prep_time, rating,
+                               diet_type, cuisine_type, ingredients, health_benefits,
+                               allergen_mask, allergen_version,
+                               protein_g, carbs_g, fat_g, fiber_g, nutrition_version, catalog_version, meal_key)
+            VALUES %s
+        """, rows, page_size=1000)
+        return len(rows)
+    
+    def _meal_keys(self, meals):
+        """Stable keys for a version's meals: an explicit meal_key or the
+        normalized name, numbered in input order when names repeat"""
+        seen = {}
+        keys = []
+        for meal in meals:
+            key = meal.get('meal_key') or ' '.join(meal['name'].lower().split())
+            seen[key] = seen.get(key, 0) + 1
+            keys.append(key if seen[key] == 1 else f"{key}#{seen[key]}")
+        return keys
+    
     def get_meals_by_preferences(self, diet_type, preferences, allergies, health_goal):
         """Get meals based on user preferences - simplified version"""
         with self.get_cursor() as cur:
@@ -223,8 +459,9 @@ class Database:
             prefs_array = self._format_array_param(preferences)
             allergies_array = self._format_array_param(allergies)
             
-            # Build query dynamically based on parameters
-            query_parts = []
+            # Build query dynamically based on parameters, always scoped to
+            # the live catalog version
+            query_parts = ["meals.catalog_version = (SELECT active_version FROM catalog_state)"]
             params = []
             
             # Diet type filter
@@ -238,29 +475,70 @@ class Database:
                 query_parts.append(f"cuisine_type IN ({placeholders})")
                 params.extend(prefs_array)
             
-            # Allergies filter
-            if allergies_array:
-                # For each allergy, check if it's not in ingredients
-                for allergy in allergies_array:
-                    query_parts.append("NOT (%s = ANY(ingredients))")
-                    params.append(allergy)
+            # Allergies filter: one bitwise test for known allergen groups,
+            # exact ingredient match only for terms outside the taxonomy
+            excluded_mask, unmatched_allergies = allergy_mask(allergies_array)
+            if excluded_mask:
+                query_parts.append("(allergen_mask & %s) = 0")
+                params.append(excluded_mask)
+            for allergy in unmatched_allergies:
+                query_parts.append("NOT (%s = ANY(ingredients))")
+                params.append(allergy)
             
             # Build final query
-            if query_parts:
-                where_clause = "WHERE " + " AND ".join(query_parts)
-            else:
-                where_clause = ""
+            where_clause = "WHERE " + " AND ".join(query_parts)
             
+            # feedback_score is the precomputed Bayesian rating, or the seed
+            # rating for meals nobody has reacted to yet
             query = f"""
-                SELECT * FROM meals 
+                SELECT meals.*,
+                       COALESCE(agg.likes, 0) AS likes,
+                       COALESCE(agg.dislikes, 0) AS dislikes,
+                       COALESCE(agg.score, meals.rating) AS feedback_score
+                FROM meals
+                LEFT JOIN meal_rating_aggregates agg ON agg.meal_key = meals.meal_key
                 {where_clause}
-                ORDER BY rating DESC
+                ORDER BY feedback_score DESC NULLS LAST
                 LIMIT 10
             """
             
             cur.execute(query, params)
             return cur.fetchall()
     
+    def get_catalog_state(self):
+        """Active catalog version plus a cheap fingerprint of its meals"""
+        with self.get_cursor() as cur:
+            cur.execute("""
+                SELECT s.active_version AS version,
+                       COUNT(m.id) AS count,
+                       COALESCE(MAX(m.id), 0) AS max_id
+                FROM catalog_state s
+                LEFT JOIN meals m ON m.catalog_version = s.active_version
+                GROUP BY s.active_version
+            """)
+            return cur.fetchone()
+    
+    def get_active_catalog_version(self):
+        """Live catalog version alone, without touching meals"""
+        with self.get_cursor() as cur:
+            cur.execute("SELECT active_version FROM catalog_state")
+            return cur.fetchone()['active_version']
+    
+    def get_all_meals(self, after_id=0, catalog_version=None):
+        """Get every meal of a catalog version (the live one by default) past `after_id`"""
+        with self.get_cursor() as cur:
+            if catalog_version is None:
+                cur.execute("""
+                    SELECT * FROM meals
+                    WHERE catalog_version = (SELECT active_version FROM catalog_state) AND id > %s
+                    ORDER BY id
+                """, (after_id,))
+            else:
+                cur.execute("""
+                    SELECT * FROM meals WHERE catalog_version = %s AND id > %s ORDER BY id
+                """, (catalog_version, after_id))
+            return cur.fetchall()
+    
     def save_user_preferences(self, user_id, diet_type, preferences, allergies, health_goal):
         """Save user preferences for future recommendations"""
         with self.get_cursor() as cur:
@@ -294,39 +572,234 @@ class Database:
             return result
     
     def save_meal_feedback(self, user_id, meal_id, liked, feedback=None):
-        """Save user feedback on a meal"""
+        """Save user feedback on a meal; returns False if the meal does not exist"""
+        with self.get_cursor() as cur:
+            cur.execute("""
+                INSERT INTO meal_feedback (user_id, meal_id, meal_key, liked, feedback)
+                SELECT %s, id, meal_key, %s, %s FROM meals WHERE id = %s
+            """, (user_id, liked, feedback, meal_id))
+            return cur.rowcount > 0
+    
+    def resolve_meal_id(self, meal_id):
+        """Id of the same meal in the live catalog version, or None"""
+        with self.get_cursor() as cur:
+            cur.execute(f"SELECT ({LIVE_MEAL_ID_SQL}) AS id", (meal_id,))
+            return cur.fetchone()['id']
+    
+    def iter_meal_feedback(self, after_id=0, chunk_size=50000):
+        """Yield meal_feedback rows in id order, one chunk per query"""
+        while True:
+            with self.get_cursor() as cur:
+                cur.execute("""
+                    SELECT id, user_id, meal_key, liked
+                    FROM meal_feedback
+                    WHERE id > %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (after_id, chunk_size))
+                rows = cur.fetchall()
+            if not rows:
+                return
+            yield rows
+            after_id = rows[-1]['id']
+    
+    def iter_user_preferences(self, after_user_id=0, fetch_size=10000):
+        """Yield saved preferences in user_id order through a server-side cursor"""
+        with self.get_connection() as conn:
+            try:
+                with conn.cursor(name="iter_user_preferences", cursor_factory=RealDictCursor) as cur:
+                    cur.itersize = fetch_size
+                    cur.execute("""
+                        SELECT user_id, diet_type, preferences, allergies, health_goal
+                        FROM user_preferences
+                        WHERE user_id > %s
+                        ORDER BY user_id
+                    """, (after_user_id,))
+                    while True:
+                        rows = cur.fetchmany(fetch_size)
+                        if not rows:
+                            return
+                        yield rows
+            finally:
+                conn.rollback()
+    
+    def get_job_state(self, name):
+        """Get the high-water mark recorded by a batch job"""
+        with self.get_cursor() as cur:
+            cur.execute("SELECT high_water_mark FROM job_state WHERE name = %s", (name,))
+            result = cur.fetchone()
+            return result['high_water_mark'] if result else 0
+    
+    def set_job_state(self, name, high_water_mark, cur=None):
+        """Record a batch job's high-water mark, optionally inside a caller's transaction"""
+        query = """
+            INSERT INTO job_state (name, high_water_mark)
+            VALUES (%s, %s)
+            ON CONFLICT (name)
+            DO UPDATE SET high_water_mark = EXCLUDED.high_water_mark, updated_at = CURRENT_TIMESTAMP
+        """
+        if cur is not None:
+            cur.execute(query, (name, high_water_mark))
+            return
+        with self.get_cursor() as cur:
+            cur.execute(query, (name, high_water_mark))
+    
+    def get_user_top_meals(self, user_id):
+        """Get a user's precomputed personalized candidates as {meal_id: score}
+        for the live catalog version"""
         with self.get_cursor() as cur:
             cur.execute("""
-                INSERT INTO meal_feedback (user_id, meal_id, liked, feedback)
-                VALUES (%s, %s, %s, %s)
-            """, (user_id, meal_id, liked, feedback))
+                SELECT live.id, t.score
+                FROM user_top_meals u
+                CROSS JOIN unnest(u.meal_keys, u.scores) AS t(meal_key, score)
+                JOIN meals live ON live.meal_key = t.meal_key
+                 AND live.catalog_version = (SELECT active_version FROM catalog_state)
+                WHERE u.user_id = %s
+            """, (user_id,))
+            return {row['id']: row['score'] for row in cur.fetchall()}
     
     def add_to_meal_history(self, user_id, meal_id):
         """Add a meal to user's history"""
         with self.get_cursor() as cur:
             cur.execute("""
-                INSERT INTO meal_history (user_id, meal_id)
-                VALUES (%s, %s)
+                INSERT INTO meal_history (user_id, meal_id, meal_key)
+                SELECT %s, id, meal_key FROM meals WHERE id = %s
             """, (user_id, meal_id))
     
-    def get_meal_history(self, user_id, limit=10):
-        """Get user's meal history"""
+    def get_meal_history(self, user_id, limit=10, before=None):
+        """Get one page of user's meal history, newest first.
+
+        `before` is the (viewed_at, history_id) of the last row of the
+        previous page; rows strictly older than it are returned.
+        """
         with self.get_cursor() as cur:
-            cur.execute("""
-                SELECT m.*, mh.viewed_at
+            keyset = "AND (mh.viewed_at, mh.id) < (%s, %s)" if before else ""
+            cur.execute(f"""
+                SELECT m.*, mh.viewed_at, mh.id AS history_id
                 FROM meal_history mh
                 JOIN meals m ON mh.meal_id = m.id
-                WHERE mh.user_id = %s
-                ORDER BY mh.viewed_at DESC
+                WHERE mh.user_id = %s {keyset}
+                ORDER BY mh.viewed_at DESC, mh.id DESC
                 LIMIT %s
-            """, (user_id, limit))
+            """, (user_id, *(before or ()), limit))
             
             return cur.fetchall()
-    def reset_meals_data(self):
-        """Reset meals data with proper image URLs"""
+    
+    def iter_user_export(self, user_id, fetch_size=500):
+        """Yield a user's history and feedback rows in chunks of `fetch_size`.
+
+        Uses a server-side cursor so only one chunk is held in memory
+        however long the history is.
+        """
+        queries = [
+            ('history', """
+                SELECT mh.id, mh.meal_id, m.name AS meal_name, mh.viewed_at
+                FROM meal_history mh
+                LEFT JOIN meals m ON mh.meal_id = m.id
+                WHERE mh.user_id = %s
+                ORDER BY mh.viewed_at, mh.id
+            """),
+            ('feedback', """
+                SELECT mf.id, mf.meal_id, m.name AS meal_name, mf.liked, mf.feedback, mf.created_at
+                FROM meal_feedback mf
+                LEFT JOIN meals m ON mf.meal_id = m.id
+                WHERE mf.user_id = %s
+                ORDER BY mf.id
+            """)
+        ]
+        with self.get_connection() as conn:
+            try:
+                for kind, query in queries:
+                    with conn.cursor(name=f"export_{kind}_{user_id}", cursor_factory=RealDictCursor) as cur:
+                        cur.itersize = fetch_size
+                        cur.execute(query, (user_id,))
+                        while True:
+                            rows = cur.fetchmany(fetch_size)
+                            if not rows:
+                                break
+                            yield kind, rows
+            finally:
+                conn.rollback()
+    def reset_meals_data(self, meals=None):
+        """Load a new catalog version next to the live one and switch to it.
+
+        Readers keep using the current version while the new one is
+        bulk-loaded; the switch is a single-row update of catalog_state.
+        Returns the new version number.
+        """
         with self.get_cursor() as cur:
-            # Clear existing meals
-            cur.execute("DELETE FROM meals")
-            # Insert new sample data
-            self.insert_sample_data(cur)
-            return True
+            cur.execute("INSERT INTO catalog_versions (status) VALUES ('building') RETURNING version")
+            version = cur.fetchone()['version']
+        
+        try:
+            with self.get_cursor() as cur:
+                if meals is None:
+                    count = self.insert_sample_data(cur, version)
+                else:
+                    count = self.bulk_insert_meals(cur, meals, version)
+                cur.execute("""
+                    UPDATE catalog_versions SET status = 'ready', meal_count = %s WHERE version = %s
+                """, (count, version))
+                # Fresh statistics before readers start planning against the new rows
+                cur.execute("ANALYZE meals")
+        except Exception:
+            with self.get_cursor() as cur:
+                cur.execute("UPDATE catalog_versions SET status = 'failed' WHERE version = %s", (version,))
+            raise
+        
+        self.activate_catalog_version(version)
+        self.prune_catalog_versions()
+        return version
+    
+    def activate_catalog_version(self, version):
+        """Atomically point readers at a loaded catalog version"""
+        with self.get_cursor() as cur:
+            cur.execute("SELECT active_version FROM catalog_state FOR UPDATE")
+            previous = cur.fetchone()['active_version']
+            cur.execute("UPDATE catalog_state SET active_version = %s", (version,))
+            cur.execute("""
+                UPDATE catalog_versions SET status = 'retired' WHERE version = %s
+            """, (previous,))
+            cur.execute("""
+                UPDATE catalog_versions SET status = 'active', activated_at = CURRENT_TIMESTAMP
+                WHERE version = %s
+            """, (version,))
+            self._rescore_ratings(cur, version)
+    
+    def _rescore_ratings(self, cur, version):
+        """Re-derive rating scores against `version`'s seeded ratings.
+
+        Aggregates are keyed by meal_key, so they carry over unchanged;
+        only scores whose prior moved are rewritten.
+        """
+        # Imported here because meal_ratings builds on this module
+        from meal_ratings import JOB_NAME as RATINGS_JOB, PRIOR_WEIGHT, SCORE_SQL
+        
+        # Hold the aggregator's job row so an update cannot interleave with the rescore
+        cur.execute("SELECT 1 FROM job_state WHERE name = %s FOR UPDATE", (RATINGS_JOB,))
+        cur.execute(f"""
+            UPDATE meal_rating_aggregates a
+            SET score = {SCORE_SQL}, updated_at = CURRENT_TIMESTAMP
+            FROM meals m
+            WHERE m.meal_key = a.meal_key AND m.catalog_version = %(version)s
+              AND a.score IS DISTINCT FROM {SCORE_SQL}
+        """, {'prior_weight': PRIOR_WEIGHT, 'version': version})
+    
+    def prune_catalog_versions(self):
+        """Delete meals of retired versions that no feedback or history refers to.
+
+        The most recently retired version is kept so ids clients fetched
+        before the switch still resolve to the live meal.
+        """
+        with self.get_cursor() as cur:
+            cur.execute("""
+                DELETE FROM meals m
+                WHERE m.catalog_version <> (SELECT active_version FROM catalog_state)
+                  AND m.catalog_version IN (SELECT version FROM catalog_versions WHERE status IN ('retired', 'failed'))
+                  AND m.catalog_version <> (
+                      SELECT COALESCE(MAX(version), 0) FROM catalog_versions WHERE status = 'retired'
+                  )
+                  AND NOT EXISTS (SELECT 1 FROM meal_feedback f WHERE f.meal_id = m.id)
+                  AND NOT EXISTS (SELECT 1 FROM meal_history h WHERE h.meal_id = m.id)
+            """)
+            return cur.rowcount
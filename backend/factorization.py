@@ -0,0 +1,270 @@
+"""Offline implicit-feedback matrix factorization over meal_feedback.
+
+Usage:
+    python factorization.py train [--factors 32] [--iterations 10]
+    python factorization.py fold-in
+
+`train` fits user and meal factors from scratch with alternating least
+squares and writes per-user top-N candidate lists. Meals are identified by
+meal_key, so factors survive catalog reloads; ids are resolved against the
+live version when the candidates are read. `fold-in` only
+recomputes users with feedback newer than the last run, keeping meal
+factors fixed.
+"""
+import argparse
+import time
+import numpy as np
+from psycopg2.extras import execute_values
+from database import Database
+
+JOB_NAME = 'factorization'
+
+
+class ImplicitALS:
+    """Implicit-feedback ALS (Hu, Koren & Volinsky) on NumPy.
+
+    Each observation has a binary preference (liked or not) and a confidence
+    growing with how many times the user reacted to the meal.
+    """
+
+    def __init__(self, factors=32, regularization=0.1, alpha=10.0, iterations=10, seed=0):
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.seed = seed
+        self.user_factors = None
+        self.item_factors = None
+
+    def fit(self, users, items, preferences, confidences, n_users, n_items):
+        rng = np.random.default_rng(self.seed)
+        self.user_factors = rng.normal(0, 0.01, (n_users, self.factors))
+        self.item_factors = rng.normal(0, 0.01, (n_items, self.factors))
+        by_user = _to_csr(users, items, preferences, confidences, n_users)
+        by_item = _to_csr(items, users, preferences, confidences, n_items)
+        for _ in range(self.iterations):
+            self.user_factors = self._solve(by_user, self.item_factors)
+            self.item_factors = self._solve(by_item, self.user_factors)
+        return self
+
+    def fold_in(self, users):
+        """User vectors for new feedback against the fixed item factors.
+
+        `users` holds one (items, preferences, confidences) triple per user.
+        They are stacked into one CSR so the item Gram matrix is computed
+        once per call rather than once per user.
+        """
+        indptr = np.zeros(len(users) + 1, dtype=np.int64)
+        np.cumsum([len(items) for items, _, _ in users], out=indptr[1:])
+        if not users:
+            return np.zeros((0, self.factors))
+        items = np.concatenate([np.asarray(items, dtype=np.int64) for items, _, _ in users])
+        preferences = np.concatenate([np.asarray(p, dtype=np.float64) for _, p, _ in users])
+        confidences = np.concatenate([np.asarray(c, dtype=np.float64) for _, _, c in users])
+        return self._solve((indptr, items, preferences, confidences), self.item_factors)
+
+    def _solve(self, csr, fixed):
+        indptr, indices, preferences, confidences = csr
+        gram = fixed.T @ fixed + self.regularization * np.eye(self.factors)
+        solved = np.zeros((len(indptr) - 1, self.factors))
+        for row in range(len(indptr) - 1):
+            start, end = indptr[row], indptr[row + 1]
+            if start == end:
+                continue
+            block = fixed[indices[start:end]]
+            confidence = confidences[start:end]
+            a = gram + (block.T * (confidence - 1)) @ block
+            b = (block.T * confidence) @ preferences[start:end]
+            solved[row] = np.linalg.solve(a, b)
+        return solved
+
+    def confidence(self, counts):
+        return 1.0 + self.alpha * counts
+
+
+def _to_csr(rows, columns, preferences, confidences, n_rows):
+    order = np.argsort(rows, kind='stable')
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, columns[order], preferences[order], confidences[order]
+
+
+def top_n(user_vectors, item_factors, n, exclude=None, block_size=1024):
+    """Top-n item rows per user computed in blocks of users"""
+    n = min(n, item_factors.shape[0])
+    results = []
+    for start in range(0, len(user_vectors), block_size):
+        scores = user_vectors[start:start + block_size] @ item_factors.T
+        if exclude:
+            for offset in range(len(scores)):
+                excluded = exclude.get(start + offset)
+                if excluded:
+                    scores[offset, excluded] = -np.inf
+        best = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        results.extend(zip(np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)))
+    return results
+
+
+class FactorizationJob:
+    """Reads meal_feedback in chunks and writes factor and top-N tables"""
+
+    def __init__(self, db=None, model=None, top_n=50, chunk_size=50000):
+        self.db = db or Database()
+        self.model = model or ImplicitALS()
+        self.top_n = top_n
+        self.chunk_size = chunk_size
+
+    def _load_feedback(self, after_id=0):
+        """Aggregate feedback into net like counts per (user, meal_key) pair"""
+        net = {}
+        high_water_mark = after_id
+        for chunk in self.db.iter_meal_feedback(after_id, self.chunk_size):
+            for row in chunk:
+                if row['meal_key'] is None or row['liked'] is None:
+                    continue
+                key = (row['user_id'], row['meal_key'])
+                net[key] = net.get(key, 0) + (1 if row['liked'] else -1)
+            high_water_mark = chunk[-1]['id']
+        return net, high_water_mark
+
+    def train(self):
+        started = time.time()
+        net, high_water_mark = self._load_feedback()
+        if not net:
+            print("No feedback to train on")
+            return
+
+        user_ids = sorted({user for user, _ in net})
+        meal_keys = sorted({meal for _, meal in net})
+        user_rows = {user: row for row, user in enumerate(user_ids)}
+        meal_rows = {meal: row for row, meal in enumerate(meal_keys)}
+        users = np.array([user_rows[user] for user, _ in net], dtype=np.int64)
+        items = np.array([meal_rows[meal] for _, meal in net], dtype=np.int64)
+        counts = np.array(list(net.values()), dtype=np.float64)
+        preferences = (counts > 0).astype(np.float64)
+        confidences = self.model.confidence(np.abs(counts))
+
+        self.model.fit(users, items, preferences, confidences, len(user_ids), len(meal_keys))
+
+        disliked = {}
+        for (user, meal), count in net.items():
+            if count < 0:
+                disliked.setdefault(user_rows[user], []).append(meal_rows[meal])
+        top = top_n(self.model.user_factors, self.model.item_factors, self.top_n, disliked)
+
+        with self.db.get_cursor() as cur:
+            cur.execute("TRUNCATE meal_factors")
+            execute_values(cur, "INSERT INTO meal_factors (meal_key, factors) VALUES %s",
+                           [(meal, self.model.item_factors[row].tolist()) for meal, row in meal_rows.items()],
+                           page_size=1000)
+            self._write_users(cur, user_ids, self.model.user_factors, top, meal_keys)
+            self.db.set_job_state(JOB_NAME, high_water_mark, cur)
+        print(f"Trained on {len(net)} pairs ({len(user_ids)} users, {len(meal_keys)} meals) "
+              f"in {time.time() - started:.1f}s")
+
+    def fold_in(self):
+        """Refresh users whose feedback arrived after the last run"""
+        started = time.time()
+        after_id = self.db.get_job_state(JOB_NAME)
+        new_net, high_water_mark = self._load_feedback(after_id)
+        if not new_net:
+            print("No new feedback")
+            return
+
+        meal_keys, item_factors = self._load_meal_factors()
+        if not meal_keys:
+            print("No trained model, run `train` first")
+            return
+        self.model.item_factors = item_factors
+        self.model.factors = item_factors.shape[1]
+        meal_rows = {meal: row for row, meal in enumerate(meal_keys)}
+
+        # A user's vector depends on all their feedback, not only the new rows
+        changed_users = sorted({user for user, _ in new_net})
+        by_user = {}
+        for (user, meal), count in self._load_user_feedback(changed_users).items():
+            if meal in meal_rows:
+                by_user.setdefault(user, []).append((meal_rows[meal], count))
+
+        user_ids, feedback, disliked = [], [], {}
+        for user in changed_users:
+            pairs = by_user.get(user)
+            if not pairs:
+                continue
+            items = np.array([row for row, _ in pairs], dtype=np.int64)
+            counts = np.array([count for _, count in pairs], dtype=np.float64)
+            feedback.append((items, (counts > 0).astype(np.float64), self.model.confidence(np.abs(counts))))
+            disliked[len(user_ids)] = [row for row, count in pairs if count < 0]
+            user_ids.append(user)
+
+        with self.db.get_cursor() as cur:
+            if user_ids:
+                vectors = self.model.fold_in(feedback)
+                top = top_n(vectors, item_factors, self.top_n, disliked)
+                self._write_users(cur, user_ids, vectors, top, meal_keys)
+            self.db.set_job_state(JOB_NAME, high_water_mark, cur)
+        print(f"Folded in {len(user_ids)} users in {time.time() - started:.1f}s")
+
+    def _load_meal_factors(self):
+        with self.db.get_cursor() as cur:
+            cur.execute("SELECT meal_key, factors FROM meal_factors ORDER BY meal_key")
+            rows = cur.fetchall()
+        if not rows:
+            return [], None
+        return [row['meal_key'] for row in rows], np.array([row['factors'] for row in rows], dtype=np.float64)
+
+    def _load_user_feedback(self, user_ids):
+        net = {}
+        with self.db.get_cursor() as cur:
+            cur.execute("""
+                SELECT user_id, meal_key, liked
+                FROM meal_feedback
+                WHERE user_id = ANY(%s) AND meal_key IS NOT NULL AND liked IS NOT NULL
+            """, (user_ids,))
+            for row in cur.fetchall():
+                key = (row['user_id'], row['meal_key'])
+                net[key] = net.get(key, 0) + (1 if row['liked'] else -1)
+        return net
+
+    def _write_users(self, cur, user_ids, vectors, top, meal_keys):
+        rows = []
+        for user, vector, (best, scores) in zip(user_ids, vectors, top):
+            keep = np.isfinite(scores)
+            rows.append((user, vector.tolist(), [meal_keys[i] for i in best[keep]],
+                         np.clip(scores[keep], 0, 1).round(4).tolist()))
+        execute_values(cur, """
+            INSERT INTO user_factors (user_id, factors) VALUES %s
+            ON CONFLICT (user_id) DO UPDATE SET factors = EXCLUDED.factors, updated_at = CURRENT_TIMESTAMP
+        """, [(user, factors) for user, factors, _, _ in rows], page_size=1000)
+        execute_values(cur, """
+            INSERT INTO user_top_meals (user_id, meal_keys, scores) VALUES %s
+            ON CONFLICT (user_id) DO UPDATE SET
+                meal_keys = EXCLUDED.meal_keys,
+                scores = EXCLUDED.scores,
+                updated_at = CURRENT_TIMESTAMP
+        """, [(user, meals, scores) for user, _, meals, scores in rows], page_size=1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train meal recommendation factors from feedback")
+    parser.add_argument('command', choices=['train', 'fold-in'])
+    parser.add_argument('--factors', type=int, default=32)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--regularization', type=float, default=0.1)
+    parser.add_argument('--alpha', type=float, default=10.0)
+    parser.add_argument('--top-n', type=int, default=50)
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    args = parser.parse_args()
+
+    model = ImplicitALS(args.factors, args.regularization, args.alpha, args.iterations)
+    job = FactorizationJob(model=model, top_n=args.top_n, chunk_size=args.chunk_size)
+    if args.command == 'train':
+        job.train()
+    else:
+        job.fold_in()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""Precomputed recommendations for the most common preference buckets.
+
+Usage:
+    python materialized.py build [--buckets 200] [--min-users 2]
+    python materialized.py status
+
+A bucket is a distinct (diet, cuisines, allergies, goal) combination
+counted from user_preferences. Each bucket is ranked with the live
+recommender and stored in recommendation_snapshots, stamped with the
+catalog version, the rating aggregator's high-water mark and the newest
+meal id it saw. It is ranked again once any of these moves on. The app
+keeps the current rows in a dict, so requests in a covered bucket skip
+filtering and ranking. Every other combination falls back to the live
+path.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from flask.json.provider import DefaultJSONProvider
+from psycopg2.extras import Json, execute_values
+from database import Database
+from meal_ratings import JOB_NAME as RATINGS_JOB
+from models import UserPreferences, preference_signature
+from recommender import MealRecommender
+
+
+class MaterializedRecommendations:
+    """Snapshot of ranked results per preference bucket for one catalog version.
+
+    Lookups poll the active version and the ratings high-water mark at most
+    every `check_interval` seconds with two single-row queries. It is also
+    registered as a catalog listener, which reports new versions and
+    appended meals. Whenever the snapshot is older than any of these, a
+    newer stored one is loaded, or built when missing, in the background,
+    and lookups miss until it is ready.
+    """
+
+    def __init__(self, recommender, db=None, max_buckets=200, min_users=2, check_interval=30):
+        self.recommender = recommender
+        self.db = db or Database()
+        self.max_buckets = max_buckets
+        self.min_users = min_users
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._building = False
+        self._results = {}
+        self._version = None
+        self._stamp = (0, 0)
+        self._active_version = None
+        self._ratings_mark = 0
+        self._max_meal_id = 0
+        self._checked_at = 0
+        self._covered_users = 0
+        self._total_users = 0
+        self._hits = 0
+        self._misses = 0
+
+    def load(self, meals):
+        version = meals[0].get('catalog_version') if meals else None
+        if version is not None:
+            with self._lock:
+                self._max_meal_id = max(meal['id'] for meal in meals)
+            self._start_refresh(version)
+
+    def add(self, meals):
+        # Appended meals are candidates the stored rankings have not seen
+        with self._lock:
+            self._max_meal_id = max([self._max_meal_id] + [meal['id'] for meal in meals])
+            version = self._version
+        if version is not None:
+            self._start_refresh(version)
+
+    def _current(self, version):
+        """Whether the loaded snapshot covers everything seen so far; call under the lock"""
+        ratings_mark, max_meal_id = self._stamp
+        return (self._version == version and ratings_mark >= self._ratings_mark
+                and max_meal_id >= self._max_meal_id)
+
+    def _start_refresh(self, version):
+        with self._lock:
+            if self._building or self._current(version):
+                return
+            self._building = True
+        threading.Thread(target=self._refresh, args=(version,), daemon=True).start()
+
+    def _check_version(self):
+        """Follow version switches and rating updates without waiting for a catalog reload"""
+        now = time.monotonic()
+        if self._active_version is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        version = self.db.get_active_catalog_version()
+        ratings_mark = self.db.get_job_state(RATINGS_JOB)
+        with self._lock:
+            self._active_version = version
+            self._ratings_mark = ratings_mark
+        self._start_refresh(version)
+
+    def _refresh(self, version):
+        try:
+            # Another process may already have stored a newer snapshot
+            self.load_version(version)
+            with self._lock:
+                current = self._current(version)
+            if not current:
+                self.build(version, only_stale=True)
+                self.load_version(version)
+        except Exception as e:
+            print(f"Error materializing recommendations for catalog version {version}: {e}")
+        finally:
+            with self._lock:
+                self._building = False
+
+    def lookup(self, user_preferences):
+        """Ranked meals for a covered bucket, or None to use the live path"""
+        self._check_version()
+        with self._lock:
+            current = self._current(self._active_version)
+            results = self._results.get(user_preferences.signature()) if current else None
+            if results is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+        return [dict(meal) for meal in results]
+
+    def load_version(self, version):
+        """Swap in the stored snapshot of a catalog version; False if none exists"""
+        with self.db.get_cursor() as cur:
+            cur.execute("""
+                SELECT diet_type, preferences, allergies, health_goal, user_count, results,
+                       ratings_mark, max_meal_id
+                FROM recommendation_snapshots
+                WHERE catalog_version = %s
+            """, (version,))
+            rows = cur.fetchall()
+            if not rows:
+                return False
+            cur.execute("SELECT COUNT(*) AS total FROM user_preferences")
+            total_users = cur.fetchone()['total']
+
+        results = {
+            preference_signature(row['diet_type'], row['preferences'], row['allergies'], row['health_goal']):
+                row['results']
+            for row in rows
+        }
+        with self._lock:
+            self._results = results
+            self._version = version
+            self._stamp = (min(row['ratings_mark'] for row in rows), min(row['max_meal_id'] for row in rows))
+            self._covered_users = sum(row['user_count'] for row in rows)
+            self._total_users = total_users
+        return True
+
+    def top_buckets(self):
+        """Most common preference combinations with their user counts"""
+        with self.db.get_cursor() as cur:
+            cur.execute("""
+                SELECT COALESCE(diet_type, 'any') AS diet_type,
+                       ARRAY(SELECT DISTINCT lower(trim(p)) FROM unnest(COALESCE(preferences, '{}')) p
+                             WHERE trim(p) <> '' ORDER BY 1) AS preferences,
+                       ARRAY(SELECT DISTINCT lower(trim(a)) FROM unnest(COALESCE(allergies, '{}')) a
+                             WHERE trim(a) <> '' ORDER BY 1) AS allergies,
+                       COALESCE(health_goal, 'maintain') AS health_goal,
+                       COUNT(*) AS user_count
+                FROM user_preferences
+                GROUP BY 1, 2, 3, 4
+                HAVING COUNT(*) >= %s
+                ORDER BY user_count DESC
+                LIMIT %s
+            """, (self.min_users, self.max_buckets))
+            return cur.fetchall()
+
+    def build(self, version=None, only_stale=False):
+        """Rank the top buckets against the live catalog and store them.
+
+        With `only_stale`, a snapshot another process stored while this one
+        waited for the build lock is kept if it is already up to date.
+        """
+        started = time.time()
+        if version is None:
+            version = self.db.get_active_catalog_version()
+        with self.db.get_cursor() as cur:
+            # One build at a time across processes; released when this transaction ends
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('recommendation_snapshots'))")
+            # Read before ranking, so the stamp never claims more than was seen
+            cur.execute("SELECT high_water_mark FROM job_state WHERE name = %s", (RATINGS_JOB,))
+            result = cur.fetchone()
+            ratings_mark = result['high_water_mark'] if result else 0
+            cur.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM meals WHERE catalog_version = %s", (version,))
+            max_meal_id = cur.fetchone()['max_id']
+            if only_stale:
+                cur.execute("""
+                    SELECT 1 FROM recommendation_snapshots
+                    WHERE catalog_version = %s AND ratings_mark >= %s AND max_meal_id >= %s
+                    LIMIT 1
+                """, (version, ratings_mark, max_meal_id))
+                if cur.fetchone():
+                    return 0
+            rows = []
+            for bucket in self.top_buckets():
+                preferences = UserPreferences(bucket['diet_type'], bucket['preferences'],
+                                              bucket['allergies'], bucket['health_goal'])
+                ranked = self.recommender.rank_for_preferences(preferences)
+                # Serialize with Flask's encoder so a hit renders timestamps and
+                # decimals exactly like jsonify does on the live path
+                ranked = json.loads(json.dumps(ranked, default=DefaultJSONProvider.default))
+                rows.append((version, bucket['diet_type'], bucket['preferences'], bucket['allergies'],
+                             bucket['health_goal'], bucket['user_count'], Json(ranked), ratings_mark, max_meal_id))
+
+            cur.execute("DELETE FROM recommendation_snapshots WHERE catalog_version = %s", (version,))
+            if rows:
+                execute_values(cur, """
+                    INSERT INTO recommendation_snapshots
+                        (catalog_version, diet_type, preferences, allergies, health_goal, user_count, results,
+                         ratings_mark, max_meal_id)
+                    VALUES %s
+                """, rows)
+            # Snapshots of versions that are no longer live are never read again
+            cur.execute("""
+                DELETE FROM recommendation_snapshots
+                WHERE catalog_version < (SELECT active_version FROM catalog_state)
+            """)
+        print(f"Materialized {len(rows)} preference buckets for catalog version {version} "
+              f"in {time.time() - started:.1f}s")
+        return len(rows)
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'catalog_version': self._version,
+                'ratings_mark': self._stamp[0],
+                'max_meal_id': self._stamp[1],
+                'buckets': len(self._results),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else None,
+                'covered_users': self._covered_users,
+                'total_users': self._total_users,
+                'user_coverage': round(self._covered_users / self._total_users, 4) if self._total_users else None,
+                'building': self._building
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute recommendations for common preference buckets")
+    parser.add_argument('command', choices=['build', 'status'])
+    parser.add_argument('--buckets', type=int, default=200)
+    parser.add_argument('--min-users', type=int, default=2)
+    args = parser.parse_args()
+
+    materialized = MaterializedRecommendations(MealRecommender(), max_buckets=args.buckets, min_users=args.min_users)
+    version = materialized.db.get_active_catalog_version()
+    if args.command == 'build':
+        materialized.build(version)
+    if not materialized.load_version(version):
+        print(f"No snapshot for catalog version {version}")
+        return 1
+    print(json.dumps(materialized.snapshot()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
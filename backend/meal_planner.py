@@ -0,0 +1,338 @@
+import random
+import threading
+import time
+import numpy as np
+from allergens import allergy_mask, meal_allergen_mask, is_meal_safe
+
+
+class MealPlanError(Exception):
+    """Raised when no plan can satisfy the hard constraints"""
+
+
+class MealPlanner:
+    """Weekly meal plans from the in-memory catalog with a time-bounded solver.
+
+    Hard constraints are diet, allergies and no repeated meal. The objective
+    adds up recommendation scores and penalizes each day's distance from the
+    calorie target and cuisines repeated within a day or across the week.
+
+    Each request filters the catalog with vectorized masks and keeps a pool
+    of the best-scoring candidates from every calorie bucket. A greedy pass
+    then builds each day around a high-scoring meal, filling the remaining
+    calories from the best meals in the matching calorie buckets. Hill-climbing swaps use whatever remains of the
+    time budget. Requests solve on a snapshot of the catalog arrays, so the
+    lock is only held to take it.
+    """
+
+    DAYS = 7
+    SLOTS = ('breakfast', 'lunch', 'dinner')
+    DAILY_CALORIES = {'lose': 1600, 'maintain': 2000, 'gain': 2600, 'energy': 2200, 'muscle': 2500}
+    BUCKET_SIZE = 25
+    CALORIE_WEIGHT = 5.0
+    DAY_CUISINE_PENALTY = 0.15
+    WEEK_CUISINE_PENALTY = 0.02
+
+    def __init__(self, recommender, pool_size=300, pair_width=30, time_budget_ms=100, patience=1000):
+        self.recommender = recommender
+        self.pool_size = pool_size
+        self.pair_width = pair_width
+        self.time_budget_ms = time_budget_ms
+        self.patience = patience
+        self._lock = threading.Lock()
+        self._meals = []
+        self._calories = np.zeros(0)
+        self._allergens = np.zeros(0, dtype=np.int64)
+        self._diets = np.zeros(0, dtype=np.int32)
+        self._cuisines = np.zeros(0, dtype=np.int32)
+        self._diet_codes = {}
+        self._cuisine_codes = {}
+        self._scores = {goal: np.zeros(0) for goal in self.DAILY_CALORIES}
+
+    def load(self, meals):
+        # Build aside and swap so plans keep using the old catalog meanwhile
+        fresh = MealPlanner(self.recommender, self.pool_size, self.pair_width,
+                            self.time_budget_ms, self.patience)
+        fresh._append(meals)
+        with self._lock:
+            self._swap_from(fresh)
+
+    def _snapshot(self):
+        """Planner sharing the current catalog arrays; caller holds the lock.
+
+        `_append` replaces the arrays instead of writing into them and only
+        extends the meal list, so the snapshot stays consistent after the
+        lock is released.
+        """
+        view = MealPlanner(self.recommender, self.pool_size, self.pair_width,
+                           self.time_budget_ms, self.patience)
+        view._swap_from(self)
+        return view
+
+    def _swap_from(self, fresh):
+        """Take over the catalog arrays built by `fresh`; caller holds the lock"""
+        self._meals = fresh._meals
+        self._calories = fresh._calories
+        self._allergens = fresh._allergens
+        self._diets = fresh._diets
+        self._cuisines = fresh._cuisines
+        self._diet_codes = fresh._diet_codes
+        self._cuisine_codes = fresh._cuisine_codes
+        self._scores = fresh._scores
+
+    def add(self, meals):
+        with self._lock:
+            self._append(meals)
+
+    def _append(self, meals):
+        """Precompute per-meal arrays so requests never score meals one by one"""
+        if not meals:
+            return
+        calories, allergens, diets, cuisines = [], [], [], []
+        for meal in meals:
+            calories.append(float(meal['calories']) if meal.get('calories') else 0.0)
+            mask = meal.get('allergen_mask')
+            allergens.append(meal_allergen_mask(meal.get('ingredients')) if mask is None else mask)
+            diets.append(self._diet_codes.setdefault(meal.get('diet_type'), len(self._diet_codes)))
+            cuisine = (meal.get('cuisine_type') or '').lower()
+            cuisines.append(self._cuisine_codes.setdefault(cuisine, len(self._cuisine_codes)))
+        self._meals.extend(meals)
+        self._calories = np.concatenate([self._calories, calories])
+        self._allergens = np.concatenate([self._allergens, np.array(allergens, dtype=np.int64)])
+        self._diets = np.concatenate([self._diets, np.array(diets, dtype=np.int32)])
+        self._cuisines = np.concatenate([self._cuisines, np.array(cuisines, dtype=np.int32)])
+        for goal in self.DAILY_CALORIES:
+            scores = [self.recommender.score_meal(meal, goal) for meal in meals]
+            self._scores[goal] = np.concatenate([self._scores[goal], scores])
+
+    def _candidates(self, user_preferences):
+        """Indexes of catalog meals allowed by the user's hard constraints"""
+        allowed = self._calories > 0
+        excluded_mask, unmatched = allergy_mask(user_preferences.allergies)
+        if excluded_mask:
+            allowed &= (self._allergens & excluded_mask) == 0
+        if user_preferences.diet_type and user_preferences.diet_type != 'any':
+            allowed &= self._diets == self._diet_codes.get(user_preferences.diet_type, -1)
+        candidates = np.flatnonzero(allowed)
+        if unmatched:
+            candidates = np.array([i for i in candidates if is_meal_safe(self._meals[i], 0, unmatched)],
+                                  dtype=np.int64)
+
+        # Cuisine preferences narrow the pool only while a full week stays possible
+        codes = [self._cuisine_codes[c.lower()] for c in user_preferences.preferences or []
+                 if c.lower() in self._cuisine_codes]
+        if codes:
+            preferred = candidates[np.isin(self._cuisines[candidates], codes)]
+            if len(preferred) >= self.DAYS * len(self.SLOTS):
+                candidates = preferred
+        return candidates
+
+    def _stratified_pool(self, candidates, scores):
+        """Best-scoring candidates of every calorie bucket, about `pool_size` in total.
+
+        Keeping each bucket represented matters when the goal's score favours
+        one end of the calorie range the target cannot be reached from.
+        """
+        if len(candidates) <= self.pool_size:
+            return candidates, scores
+        buckets = np.round(self._calories[candidates] / self.BUCKET_SIZE).astype(np.int64)
+        per_bucket = max(1, self.pool_size // len(np.unique(buckets)))
+        order = np.lexsort((-scores, buckets))
+        sorted_buckets = buckets[order]
+        starts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+        rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+        keep = order[rank < per_bucket]
+        return candidates[keep], scores[keep]
+
+    def plan(self, user_preferences, calorie_target=None, time_budget_ms=None, seed=None):
+        """Weekly plan for the preferences; raises MealPlanError if none is feasible.
+
+        The time budget covers the whole call. Filtering and pooling are
+        vectorized and always complete. Past the deadline the greedy pass
+        builds each remaining day around its first candidate only, and local
+        search stops.
+        """
+        started = time.perf_counter()
+        budget = (time_budget_ms or self.time_budget_ms) / 1000
+        # Leave headroom for building the response inside the budget
+        deadline = started + budget * 0.8
+        goal = user_preferences.health_goal if user_preferences.health_goal in self.DAILY_CALORIES else 'maintain'
+        target = float(calorie_target or self.DAILY_CALORIES[goal])
+
+        with self._lock:
+            catalog = self._snapshot()
+
+        candidates = catalog._candidates(user_preferences)
+        needed = self.DAYS * len(self.SLOTS)
+        if len(candidates) < needed:
+            raise MealPlanError(f"Only {len(candidates)} meals match these preferences, {needed} are needed")
+
+        candidates, scores = catalog._stratified_pool(candidates, catalog._scores[goal][candidates])
+        order = np.argsort(-scores, kind='stable')
+        pool = _Pool(candidates[order], scores[order], catalog._calories[candidates[order]],
+                     catalog._cuisines[candidates[order]], self.BUCKET_SIZE)
+
+        solver = _PlanSolver(pool, target, self)
+        days = solver.greedy(deadline)
+        iterations = solver.improve(days, deadline, random.Random(seed))
+        meals = catalog._meals
+
+        result_days = []
+        deviations = []
+        for day_number, day in enumerate(days, start=1):
+            day = sorted(day, key=lambda p: pool.calories[p])
+            day_meals = []
+            for slot, position in zip(self.SLOTS, day):
+                meal = dict(meals[pool.rows[position]])
+                meal['slot'] = slot
+                meal['plan_score'] = round(float(pool.scores[position]), 3)
+                day_meals.append(meal)
+            total = float(sum(pool.calories[p] for p in day))
+            deviations.append(abs(total - target) / target)
+            result_days.append({'day': day_number, 'meals': day_meals, 'total_calories': round(total)})
+
+        return {
+            'daily_calorie_target': round(target),
+            'days': result_days,
+            'average_calorie_deviation': round(float(np.mean(deviations)), 4),
+            'solver': {
+                'candidates': int(len(candidates)),
+                'iterations': iterations,
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+            }
+        }
+
+
+class _Pool:
+    """Candidate pool ordered by score, with positions bucketed by calories"""
+
+    def __init__(self, rows, scores, calories, cuisines, bucket_size):
+        self.rows = rows
+        self.scores = scores.tolist()
+        self.calories = calories.tolist()
+        self.cuisines = cuisines.tolist()
+        self.bucket_size = bucket_size
+        self.buckets = {}
+        for position, kcal in enumerate(self.calories):
+            self.buckets.setdefault(int(round(kcal / bucket_size)), []).append(position)
+
+    def best_near(self, kcal, used, exclude=(), spread=2):
+        """Highest-scoring unused meal within `spread` buckets of `kcal`"""
+        center = int(round(kcal / self.bucket_size))
+        best = None
+        for bucket in range(center - spread, center + spread + 1):
+            for position in self.buckets.get(bucket, ()):
+                if position in used or position in exclude:
+                    continue
+                if best is None or self.scores[position] > self.scores[best]:
+                    best = position
+                break
+        return best
+
+
+class _PlanSolver:
+    SPLITS = (0.3, 0.4, 0.5, 0.6, 0.7)
+
+    def __init__(self, pool, target, planner):
+        self.pool = pool
+        self.target = target
+        self.calorie_weight = planner.CALORIE_WEIGHT
+        self.day_penalty = planner.DAY_CUISINE_PENALTY
+        self.week_penalty = planner.WEEK_CUISINE_PENALTY
+        self.days = planner.DAYS
+        self.pair_width = planner.pair_width
+        self.patience = planner.patience
+
+    def day_value(self, day):
+        pool = self.pool
+        value = sum(pool.scores[p] for p in day)
+        value -= self.calorie_weight * abs(sum(pool.calories[p] for p in day) - self.target) / self.target
+        cuisines = [pool.cuisines[p] for p in day]
+        value -= self.day_penalty * (len(cuisines) - len(set(cuisines)))
+        return value
+
+    def greedy(self, deadline):
+        pool = self.pool
+        used = set()
+        days = []
+        for _ in range(self.days):
+            free = [p for p in range(len(pool.scores)) if p not in used][:self.pair_width]
+            best_day, best_value = None, None
+            for first in free:
+                # Past the deadline keep the best day found so far, if any
+                if best_day is not None and time.perf_counter() >= deadline:
+                    break
+                remaining = self.target - pool.calories[first]
+                # Try several ways of splitting what is left between the other two
+                for share in self.SPLITS:
+                    second = pool.best_near(remaining * share, used, (first,))
+                    if second is None:
+                        continue
+                    third = pool.best_near(remaining - pool.calories[second], used, (first, second))
+                    if third is None:
+                        continue
+                    day = (first, second, third)
+                    value = self.day_value(day)
+                    if best_value is None or value > best_value:
+                        best_day, best_value = day, value
+            if best_day is None:
+                # Calorie buckets exhausted or out of time: fall back to the best remaining meals
+                best_day = tuple(p for p in range(len(pool.scores)) if p not in used)[:3]
+            days.append(list(best_day))
+            used.update(best_day)
+        return days
+
+    def improve(self, days, deadline, rng):
+        """Hill-climb with slot replacements and cross-day swaps until time or patience runs out.
+
+        Moves are scored by their delta on the touched days and on the weekly
+        cuisine counts, so one step costs O(1) regardless of plan size.
+        """
+        pool = self.pool
+        used = {p for day in days for p in day}
+        day_values = [self.day_value(day) for day in days]
+        counts = {}
+        for day in days:
+            for position in day:
+                counts[pool.cuisines[position]] = counts.get(pool.cuisines[position], 0) + 1
+        iterations = 0
+        stale = 0
+        while stale < self.patience and time.perf_counter() < deadline:
+            iterations += 1
+            stale += 1
+            d = rng.randrange(len(days))
+            s = rng.randrange(3)
+            old = days[d][s]
+            if rng.random() < 0.5:
+                others = sum(pool.calories[p] for i, p in enumerate(days[d]) if i != s)
+                replacement = pool.best_near(self.target - others, used, spread=rng.randint(0, 3))
+                if replacement is None:
+                    continue
+                days[d][s] = replacement
+                new_value = self.day_value(days[d])
+                before, after = pool.cuisines[old], pool.cuisines[replacement]
+                repeats_delta = 0
+                if before != after:
+                    # (c-1)^2 terms for the cuisine losing and the one gaining a meal
+                    repeats_delta = (3 - 2 * counts[before]) + (2 * counts.get(after, 0) - 1)
+                if new_value - day_values[d] - self.week_penalty * repeats_delta > 1e-9:
+                    used.discard(old)
+                    used.add(replacement)
+                    day_values[d] = new_value
+                    counts[before] -= 1
+                    counts[after] = counts.get(after, 0) + 1
+                    stale = 0
+                else:
+                    days[d][s] = old
+            else:
+                e = rng.randrange(len(days))
+                t = rng.randrange(3)
+                if e == d:
+                    continue
+                days[d][s], days[e][t] = days[e][t], days[d][s]
+                new_d, new_e = self.day_value(days[d]), self.day_value(days[e])
+                if new_d + new_e - day_values[d] - day_values[e] > 1e-9:
+                    day_values[d], day_values[e] = new_d, new_e
+                    stale = 0
+                else:
+                    days[d][s], days[e][t] = days[e][t], days[d][s]
+        return iterations
@@ -0,0 +1,222 @@
+"""Incrementally maintained like/dislike aggregates per meal.
+
+Usage:
+    python meal_ratings.py update     # fold new meal_feedback rows into the aggregates
+    python meal_ratings.py backfill   # rebuild every aggregate from scratch
+    python meal_ratings.py check      # compare aggregates against a full recount
+
+Each meal's score is a Bayesian average on the 0-5 rating scale: the seeded
+meals.rating of the live catalog version acts as the prior worth
+PRIOR_WEIGHT votes, a like counts as a 5 and a dislike as a 1. Aggregates
+are keyed by meal_key, so they follow a meal across catalog versions.
+
+Ids are handed out before commit, so a run can see id 101 while 100 is
+still in flight. Ids missing below the high-water mark are kept in
+meal_feedback_gaps and folded in once they become visible. A gap that
+stays empty for gap_timeout seconds is taken to be a rollback and
+dropped. A transaction committing even later is only counted by
+`backfill`, and `check` reports the difference until then.
+"""
+import argparse
+import sys
+import time
+from psycopg2.extras import execute_values
+from database import Database
+
+JOB_NAME = 'meal_ratings'
+PRIOR_WEIGHT = 10
+LIKE_VALUE = 5.0
+DISLIKE_VALUE = 1.0
+DEFAULT_PRIOR = 3.0
+
+SCORE_SQL = f"""
+    (%(prior_weight)s * COALESCE(m.rating, {DEFAULT_PRIOR}) + {LIKE_VALUE} * a.likes + {DISLIKE_VALUE} * a.dislikes)
+    / (%(prior_weight)s + a.likes + a.dislikes)
+"""
+
+
+class MealRatingAggregator:
+    """Folds meal_feedback into meal_rating_aggregates past a high-water mark"""
+
+    def __init__(self, db=None, batch_size=10000, gap_timeout=600, prior_weight=PRIOR_WEIGHT):
+        self.db = db or Database()
+        self.batch_size = batch_size
+        self.gap_timeout = gap_timeout
+        self.prior_weight = prior_weight
+
+    def update(self):
+        """Process new feedback in batches; returns the number of rows consumed"""
+        total = 0
+        while True:
+            consumed = self._update_batch()
+            total += consumed
+            if consumed < self.batch_size:
+                return total
+
+    def _update_batch(self):
+        with self.db.get_cursor() as cur:
+            high_water_mark = self._lock_job(cur)
+
+            # Earlier gaps that have committed since, then new rows
+            cur.execute("""
+                DELETE FROM meal_feedback_gaps g USING meal_feedback f
+                WHERE f.id = g.id
+                RETURNING f.id, f.meal_key, f.liked
+            """)
+            late_rows = cur.fetchall()
+            cur.execute("""
+                DELETE FROM meal_feedback_gaps
+                WHERE seen_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            """, (self.gap_timeout,))
+            cur.execute("""
+                SELECT id, meal_key, liked
+                FROM meal_feedback
+                WHERE id > %s
+                ORDER BY id
+                LIMIT %s
+            """, (high_water_mark, self.batch_size))
+            rows = cur.fetchall()
+            if rows:
+                self._record_gaps(cur, high_water_mark, rows)
+                self.db.set_job_state(JOB_NAME, rows[-1]['id'], cur)
+
+            deltas = {}
+            for row in late_rows + rows:
+                if row['meal_key'] is None or row['liked'] is None:
+                    continue
+                likes, dislikes = deltas.get(row['meal_key'], (0, 0))
+                deltas[row['meal_key']] = (likes + 1, dislikes) if row['liked'] else (likes, dislikes + 1)
+
+            if deltas:
+                execute_values(cur, """
+                    INSERT INTO meal_rating_aggregates (meal_key, likes, dislikes) VALUES %s
+                    ON CONFLICT (meal_key) DO UPDATE SET
+                        likes = meal_rating_aggregates.likes + EXCLUDED.likes,
+                        dislikes = meal_rating_aggregates.dislikes + EXCLUDED.dislikes
+                """, [(meal_key, likes, dislikes) for meal_key, (likes, dislikes) in deltas.items()])
+                self._rescore(cur, list(deltas))
+            return len(rows)
+
+    def _record_gaps(self, cur, high_water_mark, rows):
+        """Remember ids skipped between the old mark and the last row read"""
+        seen = {row['id'] for row in rows}
+        missing = [(gap_id,) for gap_id in range(high_water_mark + 1, rows[-1]['id']) if gap_id not in seen]
+        if missing:
+            execute_values(cur, "INSERT INTO meal_feedback_gaps (id) VALUES %s ON CONFLICT (id) DO NOTHING",
+                           missing)
+
+    def _lock_job(self, cur):
+        """Lock the job row for this transaction so runs cannot double count"""
+        cur.execute("INSERT INTO job_state (name) VALUES (%s) ON CONFLICT (name) DO NOTHING", (JOB_NAME,))
+        cur.execute("SELECT high_water_mark FROM job_state WHERE name = %s FOR UPDATE", (JOB_NAME,))
+        return cur.fetchone()['high_water_mark']
+
+    def _rescore(self, cur, meal_keys=None):
+        """Score aggregates against the live version's ratings; meals not in
+        it keep their last score until they return"""
+        where = "AND a.meal_key = ANY(%(meal_keys)s)" if meal_keys is not None else ""
+        cur.execute(f"""
+            UPDATE meal_rating_aggregates a
+            SET score = {SCORE_SQL}, updated_at = CURRENT_TIMESTAMP
+            FROM meals m
+            WHERE m.meal_key = a.meal_key
+              AND m.catalog_version = (SELECT active_version FROM catalog_state) {where}
+        """, {'prior_weight': self.prior_weight, 'meal_keys': meal_keys})
+
+    def backfill(self):
+        """Rebuild all aggregates with one pass over meal_feedback"""
+        with self.db.get_cursor() as cur:
+            self._lock_job(cur)
+            cur.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM meal_feedback")
+            high_water_mark = cur.fetchone()['max_id']
+            cur.execute("TRUNCATE meal_rating_aggregates, meal_feedback_gaps")
+            # One statement, so the gaps are exactly the ids this count missed;
+            # only the trailing batch can still be in flight
+            cur.execute("""
+                WITH visible AS (
+                    SELECT id, meal_key, liked FROM meal_feedback WHERE id <= %(high_water_mark)s
+                ), gaps AS (
+                    INSERT INTO meal_feedback_gaps (id)
+                    SELECT g FROM generate_series(GREATEST(%(high_water_mark)s - %(window)s, 0) + 1,
+                                                  %(high_water_mark)s) g
+                    WHERE NOT EXISTS (SELECT 1 FROM visible v WHERE v.id = g)
+                )
+                INSERT INTO meal_rating_aggregates (meal_key, likes, dislikes)
+                SELECT meal_key,
+                       COUNT(*) FILTER (WHERE liked),
+                       COUNT(*) FILTER (WHERE NOT liked)
+                FROM visible
+                WHERE meal_key IS NOT NULL AND liked IS NOT NULL
+                GROUP BY meal_key
+            """, {'high_water_mark': high_water_mark, 'window': self.batch_size})
+            self._rescore(cur)
+            self.db.set_job_state(JOB_NAME, high_water_mark, cur)
+            return high_water_mark
+
+    def check(self, tolerance=1e-6):
+        """List meals whose aggregates disagree with a recount up to the high-water mark,
+        leaving out ids still pending as gaps"""
+        with self.db.get_cursor() as cur:
+            cur.execute("SELECT high_water_mark FROM job_state WHERE name = %s", (JOB_NAME,))
+            result = cur.fetchone()
+            high_water_mark = result['high_water_mark'] if result else 0
+            cur.execute(f"""
+                WITH recount AS (
+                    SELECT meal_key,
+                           COUNT(*) FILTER (WHERE liked) AS likes,
+                           COUNT(*) FILTER (WHERE NOT liked) AS dislikes
+                    FROM meal_feedback
+                    WHERE id <= %(high_water_mark)s AND meal_key IS NOT NULL AND liked IS NOT NULL
+                      AND id NOT IN (SELECT id FROM meal_feedback_gaps)
+                    GROUP BY meal_key
+                ),
+                expected AS (
+                    -- Only meals in the live version have a score to compare
+                    SELECT r.meal_key, r.likes, r.dislikes,
+                           (%(prior_weight)s * COALESCE(m.rating, {DEFAULT_PRIOR})
+                            + {LIKE_VALUE} * r.likes + {DISLIKE_VALUE} * r.dislikes)
+                           / (%(prior_weight)s + r.likes + r.dislikes) AS score,
+                           m.id IS NOT NULL AS live
+                    FROM recount r
+                    LEFT JOIN meals m ON m.meal_key = r.meal_key
+                     AND m.catalog_version = (SELECT active_version FROM catalog_state)
+                )
+                SELECT COALESCE(e.meal_key, a.meal_key) AS meal_key,
+                       e.likes AS expected_likes, a.likes AS stored_likes,
+                       e.dislikes AS expected_dislikes, a.dislikes AS stored_dislikes,
+                       e.score AS expected_score, a.score AS stored_score
+                FROM expected e
+                FULL OUTER JOIN meal_rating_aggregates a ON a.meal_key = e.meal_key
+                WHERE e.meal_key IS NULL OR a.meal_key IS NULL
+                   OR e.likes <> a.likes OR e.dislikes <> a.dislikes
+                   OR (e.live AND (a.score IS NULL OR ABS(e.score - a.score) > %(tolerance)s))
+                ORDER BY 1
+            """, {'high_water_mark': high_water_mark, 'prior_weight': self.prior_weight, 'tolerance': tolerance})
+            return high_water_mark, cur.fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain meal rating aggregates from feedback")
+    parser.add_argument('command', choices=['update', 'backfill', 'check'])
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    aggregator = MealRatingAggregator(batch_size=args.batch_size)
+    started = time.time()
+    if args.command == 'update':
+        consumed = aggregator.update()
+        print(f"Consumed {consumed} feedback rows in {time.time() - started:.1f}s")
+    elif args.command == 'backfill':
+        high_water_mark = aggregator.backfill()
+        print(f"Rebuilt aggregates up to feedback id {high_water_mark} in {time.time() - started:.1f}s")
+    else:
+        high_water_mark, mismatches = aggregator.check()
+        for row in mismatches:
+            print(dict(row))
+        print(f"{len(mismatches)} inconsistent meals up to feedback id {high_water_mark}")
+        return 1 if mismatches else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import json
 from dataclasses import dataclass
 from typing import List, Optional
 from datetime import datetime
@@ -37,6 +38,41 @@ class UserPreferences:
     preferences: List[str]
     allergies: List[str]
     health_goal: str
+    
+    def signature(self):
+        return preference_signature(self.diet_type, self.preferences, self.allergies, self.health_goal)
+
+def parse_preference_list(value):
+    """Cuisine or allergy list from a list, a JSON array string or a
+    comma-separated string, with entries stripped and lowercased"""
+    if isinstance(value, str):
+        text = value.strip()
+        items = None
+        if text.startswith('[') and text.endswith(']'):
+            try:
+                items = json.loads(text)
+            except json.JSONDecodeError:
+                pass
+        if not isinstance(items, list):
+            items = text.split(',')
+    elif isinstance(value, (list, tuple)):
+        items = value
+    else:
+        return []
+    return [str(item).strip().lower() for item in items if item is not None and str(item).strip()]
+
+def preference_signature(diet_type, preferences, allergies, health_goal):
+    """Hashable key of every preference field that affects the ranking.
+
+    Lists are normalized like the database filters them, so equivalent
+    requests share a key.
+    """
+    return (
+        diet_type or 'any',
+        tuple(sorted(set(parse_preference_list(preferences)))),
+        tuple(sorted(set(parse_preference_list(allergies)))),
+        health_goal or 'maintain'
+    )
 
 @dataclass
 class User:
@@ -0,0 +1,213 @@
+"""Per-meal macronutrients estimated from ingredient lists.
+
+Meals only list ingredient names, so each ingredient is matched to a local
+macro table (grams per 100 g, roughly USDA values for the cooked or
+ready-to-eat form) and given a typical serving weight. When the meal has a
+seeded calorie count, the summed macros are scaled so their energy matches
+it. The pipeline runs over the whole catalog at once with pandas at ingest;
+ranking only reads the stored columns.
+"""
+import numpy as np
+import pandas as pd
+from allergens import normalize_ingredient, plural_mismatches
+
+# Bump when the table or the estimation changes so stored macros get recomputed
+NUTRITION_VERSION = 2
+
+MACRO_COLUMNS = ['protein_g', 'carbs_g', 'fat_g', 'fiber_g']
+
+# name: (serving grams, protein, carbs, fat, fiber per 100 g)
+INGREDIENT_MACROS = {
+    # Proteins
+    'chicken': (120, 27.0, 0.0, 3.6, 0.0),
+    'chicken breast': (120, 31.0, 0.0, 3.6, 0.0),
+    'turkey': (120, 29.0, 0.0, 7.0, 0.0),
+    'beef': (110, 26.0, 0.0, 15.0, 0.0),
+    'ground beef': (110, 26.0, 0.0, 15.0, 0.0),
+    'pork': (120, 27.0, 0.0, 8.0, 0.0),
+    'pork loin': (120, 27.0, 0.0, 8.0, 0.0),
+    'meat': (110, 26.0, 0.0, 12.0, 0.0),
+    'poultry': (120, 27.0, 0.0, 5.0, 0.0),
+    'fish': (120, 22.0, 0.0, 5.0, 0.0),
+    'salmon': (120, 25.0, 0.0, 13.0, 0.0),
+    'cod': (120, 23.0, 0.0, 0.9, 0.0),
+    'tuna': (100, 29.0, 0.0, 1.0, 0.0),
+    'shrimp': (100, 24.0, 0.2, 0.3, 0.0),
+    'egg': (100, 13.0, 1.1, 11.0, 0.0),
+    'tofu': (120, 8.0, 1.9, 4.8, 0.3),
+    'tempeh': (100, 20.0, 7.6, 11.0, 0.0),
+    'edamame': (80, 11.0, 8.9, 5.2, 5.2),
+    'paneer': (80, 18.0, 3.6, 20.0, 0.0),
+    'bean': (120, 8.9, 24.0, 0.5, 8.7),
+    'black bean': (120, 8.9, 24.0, 0.5, 8.7),
+    'chickpea': (120, 8.9, 27.0, 2.6, 7.6),
+    'lentil': (120, 9.0, 20.0, 0.4, 7.9),
+    # Dairy
+    'cheese': (30, 25.0, 1.3, 33.0, 0.0),
+    'feta cheese': (30, 14.0, 4.1, 21.0, 0.0),
+    'parmesan': (15, 36.0, 3.2, 26.0, 0.0),
+    'yogurt': (150, 3.5, 4.7, 3.3, 0.0),
+    'greek yogurt': (150, 10.0, 3.6, 0.4, 0.0),
+    'butter': (10, 0.9, 0.1, 81.0, 0.0),
+    'milk': (200, 3.4, 5.0, 3.3, 0.0),
+    # Grains and starches
+    'quinoa': (150, 4.4, 21.0, 1.9, 2.8),
+    'rice': (150, 2.7, 28.0, 0.3, 0.4),
+    'brown rice': (150, 2.6, 23.0, 0.9, 1.8),
+    'pasta': (150, 5.8, 31.0, 0.9, 1.8),
+    'whole wheat pasta': (150, 5.3, 27.0, 0.5, 3.9),
+    'rice noodle': (150, 1.8, 24.0, 0.2, 1.0),
+    'noodle': (150, 4.5, 25.0, 2.1, 1.2),
+    'bread': (60, 9.0, 49.0, 3.2, 2.7),
+    'whole grain bread': (60, 13.0, 43.0, 3.4, 7.0),
+    'tortilla': (60, 8.0, 50.0, 7.5, 3.5),
+    'whole wheat tortilla': (60, 9.0, 46.0, 7.0, 7.0),
+    'corn tortilla': (50, 5.7, 45.0, 2.9, 6.3),
+    'sweet potato': (150, 2.0, 21.0, 0.2, 3.3),
+    'potato': (150, 2.0, 17.0, 0.1, 2.2),
+    'couscous': (150, 3.8, 23.0, 0.2, 1.4),
+    'oat': (50, 13.0, 68.0, 6.5, 10.0),
+    'barley': (150, 2.3, 28.0, 0.4, 3.8),
+    'cauliflower rice': (150, 1.9, 5.0, 0.3, 2.0),
+    # Vegetables
+    'broccoli': (90, 2.8, 7.0, 0.4, 2.6),
+    'spinach': (60, 2.9, 3.6, 0.4, 2.2),
+    'kale': (60, 4.3, 8.8, 0.9, 3.6),
+    'bell pepper': (80, 1.0, 6.0, 0.3, 2.1),
+    'carrot': (70, 0.9, 10.0, 0.2, 2.8),
+    'tomato': (80, 0.9, 3.9, 0.2, 1.2),
+    'cucumber': (80, 0.7, 3.6, 0.1, 0.5),
+    'zucchini': (90, 1.2, 3.1, 0.3, 1.0),
+    'mushroom': (70, 3.1, 3.3, 0.3, 1.0),
+    'onion': (40, 1.1, 9.3, 0.1, 1.7),
+    'garlic': (5, 6.4, 33.0, 0.5, 2.1),
+    'avocado': (70, 2.0, 8.5, 15.0, 6.7),
+    'lettuce': (50, 1.4, 2.9, 0.2, 1.3),
+    'cabbage': (70, 1.3, 5.8, 0.1, 2.5),
+    'green bean': (80, 1.8, 7.0, 0.2, 2.7),
+    'eggplant': (90, 1.0, 6.0, 0.2, 3.0),
+    'asparagus': (80, 2.2, 3.9, 0.1, 2.1),
+    'cauliflower': (90, 1.9, 5.0, 0.3, 2.0),
+    'pea': (70, 5.4, 14.0, 0.4, 5.7),
+    'corn': (80, 3.3, 19.0, 1.4, 2.0),
+    'celery': (40, 0.7, 3.0, 0.2, 1.6),
+    'beetroot': (80, 1.6, 10.0, 0.2, 2.8),
+    'microgreen': (15, 2.2, 4.0, 0.5, 2.0),
+    'vegetable': (80, 2.0, 7.0, 0.3, 2.5),
+    'green': (60, 2.5, 5.0, 0.4, 2.5),
+    'fruit': (100, 0.8, 14.0, 0.3, 2.4),
+    'berry': (80, 0.7, 12.0, 0.3, 2.4),
+    # Fats, nuts and condiments
+    'olive oil': (10, 0.0, 0.0, 100.0, 0.0),
+    'sesame oil': (5, 0.0, 0.0, 100.0, 0.0),
+    'oil': (10, 0.0, 0.0, 100.0, 0.0),
+    'peanut butter': (20, 25.0, 20.0, 50.0, 6.0),
+    'almond': (20, 21.0, 22.0, 50.0, 12.5),
+    'walnut': (20, 15.0, 14.0, 65.0, 6.7),
+    'nut': (20, 20.0, 21.0, 54.0, 7.0),
+    'seed': (15, 18.0, 23.0, 45.0, 12.0),
+    'tahini': (15, 17.0, 21.0, 54.0, 9.3),
+    'coconut milk': (60, 2.3, 6.0, 24.0, 2.2),
+    'pesto': (20, 5.0, 6.0, 45.0, 1.5),
+    'soy sauce': (15, 8.1, 4.9, 0.6, 0.8),
+    'miso': (15, 12.0, 26.0, 6.0, 5.4),
+    'fish sauce': (10, 5.1, 3.6, 0.0, 0.0),
+    'curry paste': (15, 2.0, 15.0, 8.0, 3.0),
+    'salsa': (40, 1.5, 7.0, 0.2, 1.8),
+    'honey': (10, 0.3, 82.0, 0.0, 0.2),
+    'mustard': (10, 4.4, 5.8, 4.0, 3.3),
+    'lemon juice': (15, 0.4, 6.9, 0.2, 0.3),
+    'vinegar': (10, 0.0, 0.9, 0.0, 0.0),
+    'ginger': (5, 1.8, 18.0, 0.8, 2.0),
+    'cumin': (2, 18.0, 44.0, 22.0, 11.0),
+    'cilantro': (5, 2.1, 3.7, 0.5, 2.8),
+    'basil': (5, 3.2, 2.7, 0.6, 1.6),
+    'chili flake': (2, 12.0, 50.0, 17.0, 27.0),
+}
+
+_MAX_PHRASE_WORDS = 3
+# Calorie scaling is clamped so a bad match cannot blow up the estimate
+_MIN_SCALE, _MAX_SCALE = 0.5, 2.0
+
+
+def _build_table():
+    mismatches = plural_mismatches(INGREDIENT_MACROS)
+    if mismatches:
+        raise ValueError(f"Macro table keys that do not match their plural: {mismatches}")
+    table = pd.DataFrame.from_dict(
+        {normalize_ingredient(name): values for name, values in INGREDIENT_MACROS.items()},
+        orient='index', columns=['serving_g', 'protein', 'carbs', 'fat', 'fiber']
+    )
+    table.index.name = 'key'
+    return table
+
+
+_TABLE = _build_table()
+_KEYS = set(_TABLE.index)
+
+
+def match_ingredient(ingredient):
+    """Table key for an ingredient name, or None when nothing matches.
+
+    The whole name wins; otherwise the longest phrase is used, preferring the
+    rightmost since the head noun comes last ("whole wheat pasta" -> "pasta").
+    """
+    words = normalize_ingredient(ingredient).split()
+    if not words:
+        return None
+    for size in range(min(len(words), _MAX_PHRASE_WORDS), 0, -1):
+        for start in range(len(words) - size, -1, -1):
+            phrase = ' '.join(words[start:start + size])
+            if phrase in _KEYS:
+                return phrase
+    return None
+
+
+def compute_meal_macros(meals):
+    """DataFrame of estimated macros per meal, indexed like `meals`.
+
+    Columns are MACRO_COLUMNS in grams per meal plus `matched_ratio`, the
+    share of ingredients found in the table. Meals without any matched
+    ingredient get NaN macros so callers can fall back to heuristics.
+    """
+    frame = pd.DataFrame({
+        'ingredients': [meal.get('ingredients') or [] for meal in meals],
+        'calories': [meal.get('calories') for meal in meals]
+    })
+    if frame.empty:
+        return pd.DataFrame(columns=MACRO_COLUMNS + ['matched_ratio'])
+
+    items = frame['ingredients'].explode().dropna().astype(str)
+    # Match each distinct ingredient name once, not once per meal
+    unique = items.unique()
+    keys = pd.Series([match_ingredient(name) for name in unique], index=unique)
+    items = pd.DataFrame({'meal': items.index, 'key': keys.reindex(items.values).values})
+    matched = items.dropna(subset=['key']).join(_TABLE, on='key')
+
+    grams = matched['serving_g'].to_numpy() / 100.0
+    per_item = pd.DataFrame({
+        'meal': matched['meal'].to_numpy(),
+        'protein_g': grams * matched['protein'].to_numpy(),
+        'carbs_g': grams * matched['carbs'].to_numpy(),
+        'fat_g': grams * matched['fat'].to_numpy(),
+        'fiber_g': grams * matched['fiber'].to_numpy()
+    })
+    macros = per_item.groupby('meal')[MACRO_COLUMNS].sum().reindex(frame.index)
+
+    # Scale towards the seeded calories (4/4/9 kcal per gram)
+    energy = 4 * macros['protein_g'] + 4 * macros['carbs_g'] + 9 * macros['fat_g']
+    calories = pd.to_numeric(frame['calories'], errors='coerce').astype(float)
+    scale = (calories / energy.where(energy > 0)).clip(_MIN_SCALE, _MAX_SCALE).fillna(1.0)
+    macros = macros.mul(scale, axis=0).round(1)
+
+    counts = frame['ingredients'].map(len).to_numpy()
+    matched_counts = items.dropna(subset=['key']).groupby('meal').size().reindex(frame.index, fill_value=0)
+    macros['matched_ratio'] = np.where(counts > 0, matched_counts.to_numpy() / np.maximum(counts, 1), 0.0).round(2)
+    return macros
+
+
+def macro_rows(meals):
+    """Per-meal (protein_g, carbs_g, fat_g, fiber_g) tuples with None for unknown"""
+    macros = compute_meal_macros(meals)[MACRO_COLUMNS]
+    return [tuple(None if np.isnan(value) else float(value) for value in row)
+            for row in macros.to_numpy(dtype=float)]
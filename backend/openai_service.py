@@ -1,5 +1,6 @@
 import openai
 from config import Config
+from allergens import filter_safe_meals
 import json
 
 class OpenAIService:
@@ -27,9 +28,9 @@ class OpenAIService:
                 temperature=0.7
             )
             
-            # Parse the response
+            # Parse the response and drop anything the model got wrong on allergies
             recommendations = self._parse_response(response.choices[0].message.content)
-            return recommendations
+            return filter_safe_meals(recommendations, user_preferences.allergies)
             
         except Exception as e:
             print(f"Error generating OpenAI recommendations: {e}")
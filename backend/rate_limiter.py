@@ -0,0 +1,283 @@
+import threading
+import time
+from functools import wraps
+from flask import request, jsonify
+
+# Client keys built from the remote address start with this
+ADDRESS_KEY_PREFIX = 'ip:'
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `refill_rate` tokens per second"""
+
+    def __init__(self, capacity, refill_rate, tokens=None, updated_at=None):
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self.tokens = self.capacity if tokens is None else float(tokens)
+        self.updated_at = time.monotonic() if updated_at is None else updated_at
+
+    def consume(self, now, cost=1):
+        """Take `cost` tokens; return seconds until retry (0 when admitted)"""
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
+        self.updated_at = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        if self.refill_rate <= 0:
+            return float('inf')
+        return (cost - self.tokens) / self.refill_rate
+
+
+class InProcessBackend:
+    """Token bucket state kept in this process only"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill_rate, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_keys:
+                    self._evict_full(now)
+                bucket = TokenBucket(capacity, refill_rate, updated_at=now)
+                self._buckets[key] = bucket
+            return bucket.consume(now, cost)
+
+    def _evict_full(self, now):
+        """Drop buckets that have refilled completely; they carry no state"""
+        for key in [k for k, b in self._buckets.items()
+                    if b.tokens + (now - b.updated_at) * b.refill_rate >= b.capacity]:
+            del self._buckets[key]
+
+
+class LocalKeyValueStore:
+    """Thread-safe dict with expiry, standing in for a shared store such as Redis"""
+
+    def __init__(self):
+        self._data = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+
+class SharedStoreBackend:
+    """Token bucket state kept in a key-value store shared between workers.
+
+    The store needs `get(key)`, `set(key, value, ttl)` and `lock(key)` returning
+    a context manager; `LocalKeyValueStore` implements this for local runs.
+    """
+
+    def __init__(self, store, prefix='ratelimit:'):
+        self.store = store
+        self.prefix = prefix
+
+    def take(self, key, capacity, refill_rate, cost=1):
+        store_key = self.prefix + key
+        now = time.time()
+        with self.store.lock(store_key):
+            state = self.store.get(store_key)
+            if state:
+                bucket = TokenBucket(capacity, refill_rate, tokens=state[0], updated_at=state[1])
+            else:
+                bucket = TokenBucket(capacity, refill_rate, updated_at=now)
+            retry_after = bucket.consume(now, cost)
+            ttl = capacity / refill_rate if refill_rate > 0 else None
+            self.store.set(store_key, (bucket.tokens, bucket.updated_at), ttl)
+            return retry_after
+
+
+class ConcurrencyLimiter:
+    """Per-route in-flight cap with a bounded wait queue and CoDel-style shedding.
+
+    Requests that cannot start immediately wait for a slot. If queueing delay
+    stays above `target_delay` for a whole `interval`, the limiter enters the
+    dropping state and sheds new arrivals that would have to queue, until a
+    request gets through with delay under target again.
+    """
+
+    def __init__(self, max_in_flight, max_queue=None, target_delay=0.005, interval=0.1, max_wait=None):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_in_flight * 2 if max_queue is None else max_queue
+        self.target_delay = target_delay
+        self.interval = interval
+        self.max_wait = interval * 5 if max_wait is None else max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self._first_above_time = None
+        self._dropping = False
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Return None when a slot was taken, otherwise the reason for shedding"""
+        with self._cond:
+            start = time.monotonic()
+            if self.in_flight < self.max_in_flight and self.waiting == 0:
+                self.in_flight += 1
+                self._record_delay(0.0, start)
+                return None
+            if self._dropping:
+                return 'queue_latency'
+            if self.waiting >= self.max_queue:
+                return 'queue_full'
+
+            self.waiting += 1
+            try:
+                deadline = start + self.max_wait
+                while self.in_flight >= self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._record_delay(self.max_wait, time.monotonic())
+                        return 'queue_timeout'
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+            self.in_flight += 1
+            now = time.monotonic()
+            self._record_delay(now - start, now)
+            return None
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def _record_delay(self, delay, now):
+        if delay < self.target_delay:
+            self._first_above_time = None
+            self._dropping = False
+        elif self._first_above_time is None:
+            self._first_above_time = now + self.interval
+        elif now >= self._first_above_time:
+            self._dropping = True
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'dropping': self._dropping
+            }
+
+
+class AdmissionMetrics:
+    """Counters for admission decisions keyed by route and outcome"""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, outcome):
+        with self._lock:
+            key = (route, outcome)
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for (route, outcome), count in self._counts.items():
+                result.setdefault(route, {})[outcome] = count
+            return result
+
+
+class AdmissionController:
+    """Rate limiting and load shedding for Flask routes"""
+
+    def __init__(self, backend=None, enabled=True, by_address=True):
+        self.backend = backend or InProcessBackend()
+        self.enabled = enabled
+        # Without a trustworthy client address, address-keyed buckets would
+        # throttle every anonymous caller as one client
+        self.by_address = by_address
+        self.metrics = AdmissionMetrics()
+        self._limiters = {}
+        self._routes = set()
+
+    def limit(self, route, rate=None, burst=None, max_in_flight=None, key_func=None, **limiter_options):
+        """Decorator applying a per-client token bucket and a per-route concurrency cap.
+
+        `rate` is in requests per second per client key; `key_func` returns the
+        client key (remote address by default). Route names own their token
+        buckets and concurrency limiter, so each name may be used only once.
+        """
+        if route in self._routes:
+            raise ValueError(f"Admission route {route!r} is already registered")
+        self._routes.add(route)
+        limiter = ConcurrencyLimiter(max_in_flight, **limiter_options) if max_in_flight else None
+        if limiter is not None:
+            self._limiters[route] = limiter
+        key_func = key_func or client_key
+
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if not self.enabled or request.method == 'OPTIONS':
+                    return f(*args, **kwargs)
+
+                key = key_func() if rate else None
+                if key is not None and (self.by_address or not key.startswith(ADDRESS_KEY_PREFIX)):
+                    retry_after = self.backend.take(f"{route}:{key}", burst or rate, rate)
+                    if retry_after > 0:
+                        self.metrics.record(route, 'rate_limited')
+                        return _shed_response(429, 'Too many requests', retry_after)
+
+                if limiter is None:
+                    self.metrics.record(route, 'admitted')
+                    return f(*args, **kwargs)
+
+                reason = limiter.acquire()
+                if reason:
+                    self.metrics.record(route, f'shed_{reason}')
+                    return _shed_response(503, 'Server is busy, please retry', limiter.interval)
+                self.metrics.record(route, 'admitted')
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    limiter.release()
+            return decorated
+        return decorator
+
+    def snapshot(self):
+        return {
+            'decisions': self.metrics.snapshot(),
+            'routes': {route: limiter.snapshot() for route, limiter in self._limiters.items()}
+        }
+
+
+def client_key():
+    """Identify the caller by remote address.
+
+    X-Forwarded-For is client-controlled, so it is only honoured through
+    ProxyFix when TRUSTED_PROXY_COUNT says how many proxies set it.
+    """
+    return ADDRESS_KEY_PREFIX + (request.remote_addr or 'unknown')
+
+
+def _shed_response(status, message, retry_after):
+    response = jsonify({'error': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response
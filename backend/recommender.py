@@ -3,11 +3,54 @@ from models import UserPreferences
 import decimal
 
 class MealRecommender:
+    # Share of the score taken by the offline factorization model
+    PERSONALIZATION_WEIGHT = 0.3
+    
+    # Grams per meal that count as a full score for macro-based criteria
+    PROTEIN_TARGET_G = 40
+    CARBS_TARGET_G = 80
+    FIBER_TARGET_G = 15
+    
+    # Define scoring criteria for different health goals
+    GOAL_WEIGHTS = {
+        'lose': {'calories': -0.6, 'rating': 0.4},
+        'gain': {'calories': 0.3, 'rating': 0.4, 'protein': 0.3},
+        'maintain': {'calories': -0.2, 'rating': 0.5, 'balance': 0.3},
+        'energy': {'rating': 0.4, 'carbs': 0.3, 'nutrients': 0.3},
+        'muscle': {'protein': 0.5, 'calories': 0.3, 'rating': 0.2}
+    }
+    
     def __init__(self):
         self.db = Database()
+        # Precomputed rankings for common preference buckets, see materialized.py
+        self.materialized = None
     
-    def generate_recommendations(self, user_preferences: UserPreferences):
+    def generate_recommendations(self, user_preferences: UserPreferences, user_id=None):
         """Generate meal recommendations based on user preferences"""
+        ranked_meals = self.materialized.lookup(user_preferences) if self.materialized else None
+        
+        # Precomputed top-N from factorization.py, empty for unknown users
+        personal_scores = self.db.get_user_top_meals(user_id) if user_id else {}
+        
+        if ranked_meals is not None:
+            # Snapshot hit: only the learned preference is blended in per user
+            if personal_scores:
+                return self._rank_meals(ranked_meals, user_preferences.health_goal, personal_scores)
+            return ranked_meals
+        
+        meals_list = self.candidate_meals(user_preferences)
+        
+        # Apply simple ranking based on health goal
+        ranked_meals = self._rank_meals(meals_list, user_preferences.health_goal, personal_scores)
+        
+        return ranked_meals
+    
+    def rank_for_preferences(self, user_preferences: UserPreferences):
+        """Live ranking without snapshot or personalization"""
+        return self._rank_meals(self.candidate_meals(user_preferences), user_preferences.health_goal)
+    
+    def candidate_meals(self, user_preferences: UserPreferences):
+        """Meals matching the preference filters, with numeric fields as floats"""
         # Get meals from database that match basic criteria
         meals = self.db.get_meals_by_preferences(
             user_preferences.diet_type,
@@ -26,66 +69,75 @@ class MealRecommender:
             # Convert Decimal to float for calculations
             if 'rating' in meal_dict and isinstance(meal_dict['rating'], decimal.Decimal):
                 meal_dict['rating'] = float(meal_dict['rating'])
+            if isinstance(meal_dict.get('feedback_score'), decimal.Decimal):
+                meal_dict['feedback_score'] = float(meal_dict['feedback_score'])
             if 'calories' in meal_dict and isinstance(meal_dict['calories'], decimal.Decimal):
                 meal_dict['calories'] = float(meal_dict['calories'])
             meals_list.append(meal_dict)
         
-        # Apply simple ranking based on health goal
-        ranked_meals = self._rank_meals(meals_list, user_preferences.health_goal)
-        
-        return ranked_meals
+        return meals_list
     
-    def _rank_meals(self, meals, health_goal):
+    def _rank_meals(self, meals, health_goal, personal_scores=None):
         """Simple ranking algorithm without scikit-learn"""
-        # Define scoring criteria for different health goals
-        goal_weights = {
-            'lose': {'calories': -0.6, 'rating': 0.4},
-            'gain': {'calories': 0.3, 'rating': 0.4, 'protein': 0.3},
-            'maintain': {'calories': -0.2, 'rating': 0.5, 'balance': 0.3},
-            'energy': {'rating': 0.4, 'carbs': 0.3, 'nutrients': 0.3},
-            'muscle': {'protein': 0.5, 'calories': 0.3, 'rating': 0.2}
-        }
-        
-        weights = goal_weights.get(health_goal, goal_weights['maintain'])
-        
         # Score each meal based on weights
         for meal in meals:
-            score = 0
-            
-            # Calculate score based on available information
-            if 'calories' in weights:
-                # Normalize calories (assuming 200-800 range)
-                calories = float(meal['calories']) if meal.get('calories') else 500
-                cal_norm = (calories - 200) / 600
-                score += weights['calories'] * cal_norm
-            
-            if 'rating' in weights:
-                # Normalize rating (0-5 scale)
-                rating = float(meal['rating']) if meal.get('rating') else 3.0
-                rating_norm = rating / 5
-                score += weights['rating'] * rating_norm
-            
-            # Estimate protein content based on ingredients
-            if 'protein' in weights:
-                protein_score = self._estimate_protein_content(meal.get('ingredients', []))
-                score += weights['protein'] * protein_score
-            
-            # Estimate nutrient density
-            if 'nutrients' in weights:
-                nutrient_score = self._estimate_nutrient_density(meal.get('ingredients', []))
-                score += weights['nutrients'] * nutrient_score
-            
-            # Balance score (variety of ingredients)
-            if 'balance' in weights:
-                ingredients = meal.get('ingredients', [])
-                balance_score = min(1.0, len(ingredients) / 10) if ingredients else 0.5
-                score += weights['balance'] * balance_score
-            
+            score = self.score_meal(meal, health_goal, personal_scores)
             meal['recommendation_score'] = round(score, 2)
         
         # Sort by recommendation score
         return sorted(meals, key=lambda x: x.get('recommendation_score', 0), reverse=True)
     
+    def score_meal(self, meal, health_goal, personal_scores=None):
+        """Unrounded recommendation score of one meal for a health goal"""
+        weights = self.GOAL_WEIGHTS.get(health_goal, self.GOAL_WEIGHTS['maintain'])
+        score = 0
+        
+        # Calculate score based on available information
+        if 'calories' in weights:
+            # Normalize calories (assuming 200-800 range)
+            calories = float(meal['calories']) if meal.get('calories') else 500
+            cal_norm = (calories - 200) / 600
+            score += weights['calories'] * cal_norm
+        
+        if 'rating' in weights:
+            # Normalize rating (0-5 scale), preferring the feedback-adjusted score
+            rating = meal.get('feedback_score') or meal.get('rating')
+            rating = float(rating) if rating else 3.0
+            rating_norm = rating / 5
+            score += weights['rating'] * rating_norm
+        
+        # Precomputed macros from nutrition.py, keyword estimates for meals without them
+        if 'protein' in weights:
+            if meal.get('protein_g') is not None:
+                protein_score = min(1.0, float(meal['protein_g']) / self.PROTEIN_TARGET_G)
+            else:
+                protein_score = self._estimate_protein_content(meal.get('ingredients', []))
+            score += weights['protein'] * protein_score
+        
+        if 'carbs' in weights and meal.get('carbs_g') is not None:
+            score += weights['carbs'] * min(1.0, float(meal['carbs_g']) / self.CARBS_TARGET_G)
+        
+        # Nutrient density, measured by fiber when known
+        if 'nutrients' in weights:
+            if meal.get('fiber_g') is not None:
+                nutrient_score = min(1.0, float(meal['fiber_g']) / self.FIBER_TARGET_G)
+            else:
+                nutrient_score = self._estimate_nutrient_density(meal.get('ingredients', []))
+            score += weights['nutrients'] * nutrient_score
+        
+        # Balance score (variety of ingredients)
+        if 'balance' in weights:
+            ingredients = meal.get('ingredients', [])
+            balance_score = min(1.0, len(ingredients) / 10) if ingredients else 0.5
+            score += weights['balance'] * balance_score
+        
+        # Blend in the learned preference when the user has a trained profile
+        if personal_scores:
+            personal = personal_scores.get(meal.get('id'), 0.0)
+            score = (1 - self.PERSONALIZATION_WEIGHT) * score + self.PERSONALIZATION_WEIGHT * personal
+        
+        return score
+    
     def _estimate_protein_content(self, ingredients):
         """Simple estimation of protein content based on ingredients"""
         if not ingredients:
@@ -0,0 +1,318 @@
+import math
+import re
+import threading
+import numpy as np
+from allergens import allergy_mask, meal_allergen_mask, normalize_ingredient, is_meal_safe
+
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def prefix_keys(text):
+    """Normalized forms of a partially typed phrase.
+
+    The last word may be incomplete, so it is tried both as typed ("chees")
+    and singularized ("eggs" -> "egg") to match normalized index keys.
+    """
+    words = _WORD_RE.findall(str(text).lower())
+    if not words:
+        return []
+    head = normalize_ingredient(' '.join(words[:-1]))
+    keys = []
+    for last in (words[-1], normalize_ingredient(words[-1])):
+        key = f"{head} {last}" if head else last
+        if key not in keys:
+            keys.append(key)
+    return keys
+
+
+class MealSearchIndex:
+    """Inverted index over meal text ranked with BM25.
+
+    Field boosts are applied as term-frequency multipliers (name counts more
+    than description). The last query word is also matched as a prefix so the
+    index can serve search-as-you-type without a table scan.
+    """
+
+    FIELD_BOOSTS = {'name': 3, 'ingredients': 2, 'cuisine_type': 2, 'description': 1}
+
+    def __init__(self, k1=1.2, b=0.75, max_prefix_terms=8, max_prefix_rows=2000):
+        self.k1 = k1
+        self.b = b
+        self.max_prefix_terms = max_prefix_terms
+        # Completions of a partly typed word only contribute their best rows,
+        # so a one-letter prefix cannot pull in most of the catalog
+        self.max_prefix_rows = max_prefix_rows
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._postings = {}
+        self._posting_arrays = {}
+        self._impacts_avgdl = None
+        self._terms = TermTrie()
+        self._doc_lengths = []
+        self._doc_length_array = np.zeros(0)
+        self._avgdl = 1.0
+        self._row_allergens = np.zeros(0, dtype=np.int64)
+        self._diet_codes = {}
+        self._row_diets = np.zeros(0, dtype=np.int32)
+        self._meals = []
+        self._rows = {}
+
+    def load(self, meals):
+        # Build aside and swap so searches keep hitting the old index meanwhile
+        fresh = MealSearchIndex(self.k1, self.b, self.max_prefix_terms, self.max_prefix_rows)
+        fresh._append(meals)
+        # Build every posting array now rather than on the first query using it
+        for term in fresh._postings:
+            fresh._posting_array(term)
+        with self._lock:
+            self._swap_from(fresh)
+
+    def _swap_from(self, fresh):
+        """Take over the index built by `fresh`; caller holds the lock"""
+        self._postings = fresh._postings
+        self._posting_arrays = fresh._posting_arrays
+        self._impacts_avgdl = fresh._impacts_avgdl
+        self._terms = fresh._terms
+        self._doc_lengths = fresh._doc_lengths
+        self._doc_length_array = fresh._doc_length_array
+        self._avgdl = fresh._avgdl
+        self._row_allergens = fresh._row_allergens
+        self._diet_codes = fresh._diet_codes
+        self._row_diets = fresh._row_diets
+        self._meals = fresh._meals
+        self._rows = fresh._rows
+
+    def add(self, meals):
+        with self._lock:
+            self._append([meal for meal in meals if meal['id'] not in self._rows])
+
+    def __len__(self):
+        return len(self._meals)
+
+    def _meal_terms(self, meal):
+        counts = {}
+        for field, boost in self.FIELD_BOOSTS.items():
+            value = meal.get(field)
+            if not value:
+                continue
+            text = ' '.join(value) if isinstance(value, list) else str(value)
+            for term in normalize_ingredient(text).split():
+                counts[term] = counts.get(term, 0) + boost
+        return counts
+
+    def _append(self, meals):
+        allergens = []
+        diets = []
+        new_terms = {}
+        for meal in meals:
+            row = len(self._meals)
+            counts = self._meal_terms(meal)
+            for term, tf in counts.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = ([], [])
+                postings[0].append(row)
+                postings[1].append(tf)
+                new_terms[term] = new_terms.get(term, 0) + 1
+            self._doc_lengths.append(sum(counts.values()))
+            mask = meal.get('allergen_mask')
+            allergens.append(meal_allergen_mask(meal.get('ingredients')) if mask is None else mask)
+            diets.append(self._diet_codes.setdefault(meal.get('diet_type'), len(self._diet_codes)))
+            self._meals.append(meal)
+            self._rows[meal['id']] = row
+        if not meals:
+            return
+        # Completions are ranked by document frequency
+        for term, count in new_terms.items():
+            self._posting_arrays.pop(term, None)
+            self._terms.add(term, term, count)
+        self._doc_length_array = np.array(self._doc_lengths, dtype=np.float64)
+        self._avgdl = float(self._doc_length_array.mean()) or 1.0
+        self._row_allergens = np.concatenate([self._row_allergens, np.array(allergens, dtype=np.int64)])
+        self._row_diets = np.concatenate([self._row_diets, np.array(diets, dtype=np.int32)])
+
+    def _posting_array(self, term):
+        """Posting rows with their precomputed BM25 term-frequency component,
+        highest impact first"""
+        # Impacts depend on the average document length; recompute all of them
+        # once appends have moved it noticeably
+        if self._impacts_avgdl is None or abs(self._avgdl - self._impacts_avgdl) > 0.05 * self._impacts_avgdl:
+            self._posting_arrays = {}
+            self._impacts_avgdl = self._avgdl
+        arrays = self._posting_arrays.get(term)
+        if arrays is None:
+            rows, tfs = self._postings[term]
+            rows = np.array(rows, dtype=np.int64)
+            tfs = np.array(tfs, dtype=np.float64)
+            norm = self.k1 * (1 - self.b + self.b * self._doc_length_array[rows] / self._impacts_avgdl)
+            impacts = tfs * (self.k1 + 1) / (tfs + norm)
+            order = np.argsort(-impacts, kind='stable')
+            arrays = (rows[order], impacts[order])
+            self._posting_arrays[term] = arrays
+        return arrays
+
+    def _query_terms(self, query, prefix):
+        words = normalize_ingredient(query).split()
+        if not words:
+            return []
+        terms = [word for word in words[:-1] if word in self._postings]
+        # A complete last word always counts, even when more frequent
+        # longer terms fill up its completion list
+        if words[-1] in self._postings:
+            terms.append(words[-1])
+        if prefix:
+            for key in prefix_keys(query):
+                terms.extend(self._terms.complete(key.split()[-1], self.max_prefix_terms))
+        return list(dict.fromkeys(terms))
+
+    def search(self, query, limit=20, user_preferences=None, prefix=True):
+        """Top meals for a free-text query, honouring diet and allergy filters"""
+        with self._lock:
+            terms = self._query_terms(query, prefix)
+            if not terms or not self._meals:
+                return []
+
+            words = set(normalize_ingredient(query).split())
+            n = len(self._meals)
+            rows_parts = []
+            score_parts = []
+            for term in terms:
+                rows, impacts = self._posting_array(term)
+                idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+                if term not in words:
+                    rows, impacts = rows[:self.max_prefix_rows], impacts[:self.max_prefix_rows]
+                rows_parts.append(rows)
+                score_parts.append(idf * impacts)
+            scores = np.bincount(np.concatenate(rows_parts), weights=np.concatenate(score_parts), minlength=n)
+            candidates = np.flatnonzero(scores)
+
+            # Filters only look at matching rows, not the whole catalog
+            unmatched = []
+            if user_preferences is not None:
+                excluded_mask, unmatched = allergy_mask(user_preferences.allergies)
+                if excluded_mask:
+                    candidates = candidates[(self._row_allergens[candidates] & excluded_mask) == 0]
+                if user_preferences.diet_type and user_preferences.diet_type != 'any':
+                    code = self._diet_codes.get(user_preferences.diet_type, -1)
+                    candidates = candidates[self._row_diets[candidates] == code]
+
+            window = limit * 4
+            if len(candidates) > window:
+                candidates = candidates[np.argpartition(-scores[candidates], window)[:window]]
+            candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+            results = []
+            for candidate in candidates:
+                meal = self._meals[candidate]
+                if unmatched and not is_meal_safe(meal, 0, unmatched):
+                    continue
+                result = dict(meal)
+                result['search_score'] = round(float(scores[candidate]), 4)
+                results.append(result)
+                if len(results) == limit:
+                    break
+            return results
+
+
+class _TrieNode:
+    __slots__ = ('children', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.top = []
+
+
+class TermTrie:
+    """Prefix trie where every node caches its most frequent completions"""
+
+    def __init__(self, top_k=10):
+        self.top_k = top_k
+        self.root = _TrieNode()
+        self.counts = {}
+        self.labels = {}
+
+    def add(self, key, label, count=1):
+        total = self.counts.get(key, 0) + count
+        self.counts[key] = total
+        self.labels.setdefault(key, label)
+        node = self.root
+        self._update_top(node, key, total)
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _TrieNode()
+            node = child
+            self._update_top(node, key, total)
+
+    def _update_top(self, node, key, total):
+        top = node.top
+        if key in top:
+            top.sort(key=lambda k: (-self.counts[k], k))
+            return
+        if len(top) < self.top_k:
+            top.append(key)
+        elif total > self.counts[top[-1]]:
+            top[-1] = key
+        else:
+            return
+        top.sort(key=lambda k: (-self.counts[k], k))
+
+    def complete(self, prefix, limit=None):
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.top[:limit or self.top_k]
+
+
+class IngredientAutocomplete:
+    """Ingredient suggestions by prefix of any word, most common first"""
+
+    def __init__(self, top_k=10):
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        self._trie = TermTrie(top_k)
+
+    def load(self, meals):
+        trie = TermTrie(self.top_k)
+        self._index(trie, meals)
+        with self._lock:
+            self._trie = trie
+
+    def add(self, meals):
+        with self._lock:
+            self._index(self._trie, meals)
+
+    def _index(self, trie, meals):
+        counts = {}
+        labels = {}
+        for meal in meals:
+            for ingredient in meal.get('ingredients') or []:
+                label = str(ingredient).strip().lower()
+                key = normalize_ingredient(label)
+                if not key:
+                    continue
+                counts[key] = counts.get(key, 0) + 1
+                labels.setdefault(key, label)
+        for key, count in counts.items():
+            # Index every word start so "butter" also suggests "peanut butter"
+            words = key.split()
+            for start in range(len(words)):
+                trie.add(f"{' '.join(words[start:])}\x00{key}", labels[key], count)
+
+    def suggest(self, prefix, limit=10):
+        with self._lock:
+            entries = []
+            for key in prefix_keys(prefix):
+                entries.extend(self._trie.complete(key, self.top_k))
+            entries.sort(key=lambda entry: -self._trie.counts[entry])
+            suggestions = []
+            for entry in entries:
+                label = self._trie.labels[entry]
+                if label not in suggestions:
+                    suggestions.append(label)
+            return suggestions[:limit]
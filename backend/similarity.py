@@ -0,0 +1,195 @@
+import threading
+import numpy as np
+from allergens import allergy_mask, meal_allergen_mask, normalize_ingredient, is_meal_safe
+
+
+class SimilarMealsIndex:
+    """TF-IDF vectors over ingredients, cuisine and health benefits with cosine top-k.
+
+    Vectors are sparse one-hot rows kept as per-feature posting lists, so a
+    query only touches meals sharing at least one feature with the seed meal.
+    Meals can be appended incrementally; IDF weights and row norms are fully
+    recomputed once the catalog has grown by `rebuild_ratio` since the last
+    rebuild, and only for the new rows in between.
+    """
+
+    FIELD_WEIGHTS = {'ingredient': 1.0, 'cuisine': 0.6, 'benefit': 0.4}
+
+    def __init__(self, field_weights=None, rebuild_ratio=0.1):
+        self.field_weights = field_weights or self.FIELD_WEIGHTS
+        self.rebuild_ratio = rebuild_ratio
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._feature_ids = {}
+        self._feature_weights = []
+        self._postings = []
+        self._posting_arrays = {}
+        self._df = np.zeros(0)
+        self._idf = np.zeros(0)
+        self._row_features = []
+        self._row_norms = np.zeros(0)
+        self._row_allergens = np.zeros(0, dtype=np.int64)
+        self._row_diets = []
+        self._diet_array = np.zeros(0, dtype=object)
+        self._meal_ids = []
+        self._meals = []
+        self._rows = {}
+        self._rows_at_rebuild = 0
+
+    def load(self, meals):
+        """Rebuild the index from scratch for a new catalog.
+
+        The new index is built aside and swapped in, so queries keep
+        using the previous catalog until it is ready.
+        """
+        fresh = SimilarMealsIndex(self.field_weights, self.rebuild_ratio)
+        fresh._append(meals)
+        fresh._rebuild_weights()
+        with self._lock:
+            self._swap_from(fresh)
+
+    def _swap_from(self, fresh):
+        """Take over the index built by `fresh`; caller holds the lock"""
+        self._feature_ids = fresh._feature_ids
+        self._feature_weights = fresh._feature_weights
+        self._postings = fresh._postings
+        self._posting_arrays = fresh._posting_arrays
+        self._df = fresh._df
+        self._idf = fresh._idf
+        self._row_features = fresh._row_features
+        self._row_norms = fresh._row_norms
+        self._row_allergens = fresh._row_allergens
+        self._row_diets = fresh._row_diets
+        self._diet_array = fresh._diet_array
+        self._meal_ids = fresh._meal_ids
+        self._meals = fresh._meals
+        self._rows = fresh._rows
+        self._rows_at_rebuild = fresh._rows_at_rebuild
+
+    def add(self, meals):
+        """Append new meals to the index"""
+        with self._lock:
+            first_row = len(self._meal_ids)
+            self._append([meal for meal in meals if meal['id'] not in self._rows])
+            if len(self._meal_ids) - self._rows_at_rebuild > self._rows_at_rebuild * self.rebuild_ratio:
+                self._rebuild_weights()
+            else:
+                self._update_weights(first_row)
+
+    def __len__(self):
+        return len(self._meal_ids)
+
+    def _meal_features(self, meal):
+        features = set()
+        for ingredient in meal.get('ingredients') or []:
+            normalized = normalize_ingredient(ingredient)
+            if normalized:
+                features.add(('ingredient', normalized))
+        if meal.get('cuisine_type'):
+            features.add(('cuisine', str(meal['cuisine_type']).lower()))
+        for benefit in meal.get('health_benefits') or []:
+            features.add(('benefit', str(benefit).lower()))
+        return features
+
+    def _append(self, meals):
+        allergens = []
+        for meal in meals:
+            row = len(self._meal_ids)
+            columns = []
+            for feature in self._meal_features(meal):
+                column = self._feature_ids.get(feature)
+                if column is None:
+                    column = len(self._postings)
+                    self._feature_ids[feature] = column
+                    self._feature_weights.append(self.field_weights[feature[0]])
+                    self._postings.append([])
+                self._postings[column].append(row)
+                self._posting_arrays.pop(column, None)
+                columns.append(column)
+            self._row_features.append(np.array(columns, dtype=np.int64))
+            mask = meal.get('allergen_mask')
+            allergens.append(meal_allergen_mask(meal.get('ingredients')) if mask is None else mask)
+            self._row_diets.append(meal.get('diet_type'))
+            self._meal_ids.append(meal['id'])
+            self._meals.append(meal)
+            self._rows[meal['id']] = row
+        if allergens:
+            self._row_allergens = np.concatenate([self._row_allergens, np.array(allergens, dtype=np.int64)])
+        self._diet_array = np.array(self._row_diets, dtype=object)
+
+    def _compute_idf(self):
+        self._df = np.array([len(p) for p in self._postings], dtype=np.float64)
+        n = max(1, len(self._meal_ids))
+        self._idf = (np.log((1 + n) / (1 + self._df)) + 1.0) * np.array(self._feature_weights)
+
+    def _norms_for(self, first_row):
+        features = self._row_features[first_row:]
+        if not features:
+            return np.zeros(0)
+        columns = np.concatenate(features)
+        rows = np.repeat(np.arange(len(features)), [len(f) for f in features])
+        norms = np.sqrt(np.bincount(rows, weights=self._idf[columns] ** 2, minlength=len(features)))
+        norms[norms == 0] = 1.0
+        return norms
+
+    def _rebuild_weights(self):
+        self._compute_idf()
+        self._row_norms = self._norms_for(0)
+        self._rows_at_rebuild = len(self._meal_ids)
+
+    def _update_weights(self, first_row):
+        self._compute_idf()
+        new_norms = self._norms_for(first_row)
+        self._row_norms = np.concatenate([self._row_norms, new_norms])
+
+    def _posting_array(self, column):
+        array = self._posting_arrays.get(column)
+        if array is None:
+            array = np.array(self._postings[column], dtype=np.int64)
+            self._posting_arrays[column] = array
+        return array
+
+    def similar(self, meal_id, k=10, user_preferences=None):
+        """Top-k meals most similar to `meal_id`, honouring diet and allergy filters"""
+        with self._lock:
+            row = self._rows.get(meal_id)
+            if row is None:
+                return []
+
+            columns = self._row_features[row]
+            if len(columns) == 0:
+                return []
+            postings = [self._posting_array(column) for column in columns]
+            weights = self._idf[columns] ** 2
+            rows = np.concatenate(postings)
+            contributions = np.repeat(weights, [len(p) for p in postings])
+            scores = np.bincount(rows, weights=contributions, minlength=len(self._meal_ids))
+            scores = scores / (self._row_norms * self._row_norms[row])
+            scores[row] = 0.0
+
+            excluded_mask, unmatched = 0, []
+            if user_preferences is not None:
+                excluded_mask, unmatched = allergy_mask(user_preferences.allergies)
+                if user_preferences.diet_type and user_preferences.diet_type != 'any':
+                    scores[self._diet_array != user_preferences.diet_type] = 0.0
+            if excluded_mask:
+                scores[(self._row_allergens & excluded_mask) != 0] = 0.0
+
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > k * 4:
+                candidates = candidates[np.argpartition(-scores[candidates], k * 4)[:k * 4]]
+            candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+            results = []
+            for candidate in candidates:
+                meal = self._meals[candidate]
+                if unmatched and not is_meal_safe(meal, 0, unmatched):
+                    continue
+                result = dict(meal)
+                result['similarity'] = round(float(scores[candidate]), 4)
+                results.append(result)
+                if len(results) == k:
+                    break
+            return results
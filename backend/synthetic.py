@@ -0,0 +1,70 @@
+import random
+
+CUISINES = ['mediterranean', 'asian', 'american', 'mexican', 'italian', 'indian', 'french', 'middle eastern',
+            'japanese', 'thai', 'greek', 'korean']
+DIET_TYPES = ['any', 'vegetarian', 'vegan', 'keto', 'paleo', 'gluten-free']
+HEALTH_BENEFITS = ['high fiber', 'protein rich', 'heart healthy', 'low calorie', 'vitamin rich', 'healthy fats',
+                   'low carb', 'plant-based protein', 'antioxidants', 'omega-3', 'iron rich', 'satisfying']
+PROTEINS = ['chicken breast', 'salmon', 'tofu', 'eggs', 'black beans', 'chickpeas', 'lentils', 'shrimp',
+            'ground beef', 'turkey', 'tempeh', 'cod', 'pork loin', 'greek yogurt', 'paneer', 'edamame']
+BASES = ['quinoa', 'brown rice', 'whole wheat pasta', 'rice noodles', 'whole grain bread', 'sweet potato',
+         'couscous', 'corn tortilla', 'whole wheat tortilla', 'oats', 'barley', 'cauliflower rice']
+VEGETABLES = ['broccoli', 'spinach', 'kale', 'bell peppers', 'carrots', 'tomato', 'cucumber', 'zucchini',
+              'mushrooms', 'onion', 'garlic', 'avocado', 'lettuce', 'cabbage', 'green beans', 'eggplant',
+              'asparagus', 'cauliflower', 'peas', 'corn', 'celery', 'beetroot']
+EXTRAS = ['olive oil', 'feta cheese', 'parmesan', 'soy sauce', 'sesame oil', 'peanut butter', 'almonds',
+          'walnuts', 'lemon juice', 'coconut milk', 'tahini', 'salsa', 'pesto', 'butter', 'honey', 'ginger',
+          'cumin', 'curry paste', 'mustard', 'miso', 'fish sauce', 'cilantro', 'basil', 'chili flakes']
+DISHES = ['Bowl', 'Salad', 'Stir Fry', 'Curry', 'Wrap', 'Soup', 'Skillet', 'Bake', 'Tacos', 'Pasta',
+          'Sandwich', 'Stew', 'Plate', 'Burrito', 'Noodles', 'Frittata']
+STYLES = ['Grilled', 'Roasted', 'Spicy', 'Creamy', 'Zesty', 'Smoky', 'Crispy', 'Herbed', 'Garlic',
+          'Lemon', 'Sesame', 'Harvest', 'Rainbow', 'Classic', 'Rustic', 'Golden']
+
+
+def generate_meals(count, seed=42, start_id=1):
+    """Deterministic synthetic catalog shaped like the meals table"""
+    rng = random.Random(seed)
+    meals = []
+    for offset in range(count):
+        protein = rng.choice(PROTEINS)
+        base = rng.choice(BASES)
+        vegetables = rng.sample(VEGETABLES, rng.randint(2, 4))
+        extras = rng.sample(EXTRAS, rng.randint(1, 3))
+        cuisine = rng.choice(CUISINES)
+        dish = rng.choice(DISHES)
+        name = f"{rng.choice(STYLES)} {protein.split()[0].title()} {dish}"
+        meals.append({
+            'id': start_id + offset,
+            'name': name,
+            'description': f"A {cuisine} {dish.lower()} with {protein}, {base} and {', '.join(vegetables)}.",
+            'image_url': None,
+            'calories': rng.randrange(200, 900, 10),
+            'prep_time': rng.randrange(5, 65, 5),
+            'rating': round(rng.uniform(3.0, 5.0), 1),
+            'diet_type': rng.choice(DIET_TYPES),
+            'cuisine_type': cuisine,
+            'ingredients': [protein, base] + vegetables + extras,
+            'health_benefits': rng.sample(HEALTH_BENEFITS, rng.randint(1, 3))
+        })
+    return meals
+
+
+HEALTH_GOALS = ['maintain', 'lose', 'gain', 'energy', 'muscle']
+ALLERGIES = ['peanut', 'tree nut', 'dairy', 'egg', 'gluten', 'soy', 'fish', 'shellfish', 'sesame']
+
+
+def generate_user_preferences(count, seed=7, start_id=1):
+    """Deterministic user_preferences rows with a realistic long tail.
+
+    Most users keep the defaults or pick one or two cuisines, so many share
+    a preference signature; a few pick rarer combinations.
+    """
+    rng = random.Random(f"{seed}:{start_id}")
+    for offset in range(count):
+        yield {
+            'user_id': start_id + offset,
+            'diet_type': rng.choice(DIET_TYPES) if rng.random() < 0.5 else 'any',
+            'preferences': rng.sample(CUISINES, min(int(rng.expovariate(1.2)), 4)),
+            'allergies': rng.sample(ALLERGIES, min(int(rng.expovariate(2.0)), 3)),
+            'health_goal': rng.choice(HEALTH_GOALS)
+        }
@@ -0,0 +1,91 @@
+"""Sanitized request capture for offline replay.
+
+With TRAFFIC_CAPTURE_ENABLED the app appends one JSON line per request to
+TRAFFIC_CAPTURE_PATH. A line records the route template, the preference
+and query fields needed to rebuild the request, whether it was
+authenticated, the response status and the server-side duration. Raw
+identities and free text are never stored. Passwords, emails, names,
+tokens and feedback text are dropped. Search text is reduced to its
+length, token count and a salted hash, and callers to a salted hash;
+both hashes only stay stable for the lifetime of the process.
+benchmarks/replay.py replays the file.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+# Request fields kept as-is; everything else is dropped
+BODY_FIELDS = {'diet_type', 'preferences', 'allergies', 'health_goal', 'calorie_target', 'meal_id', 'liked'}
+QUERY_FIELDS = {'limit', 'diet_type', 'preferences', 'allergies', 'health_goal'}
+# Free-text query fields, stored only as their shape
+TEXT_FIELDS = {'q', 'prefix'}
+MAX_TEXT_LENGTH = 64
+
+
+def _clip(value):
+    if isinstance(value, str):
+        return value[:MAX_TEXT_LENGTH]
+    if isinstance(value, list):
+        return [_clip(item) for item in value[:20]]
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return None
+
+
+class TrafficRecorder:
+    """Appends sanitized request shapes to a JSONL file"""
+
+    def __init__(self, path, sample_rate=1.0):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._salt = os.urandom(16)
+
+    def client_id(self, request):
+        """Opaque per-caller id so replay can keep the user mix without identities"""
+        auth_header = request.headers.get('Authorization', '')
+        raw = auth_header if auth_header.startswith('Bearer ') else (request.remote_addr or '')
+        return hashlib.sha256(self._salt + raw.encode()).hexdigest()[:12]
+
+    def text_shape(self, text):
+        """What replay needs to reproduce a query's cost: its length, token
+        count and an opaque id so repeated queries stay repeated"""
+        normalized = ' '.join(text.lower().split())
+        return {
+            'length': len(text),
+            'tokens': len(normalized.split()),
+            'hash': hashlib.sha256(self._salt + normalized.encode()).hexdigest()[:12]
+        }
+
+    def capture(self, request, response, duration_ms):
+        if request.method == 'OPTIONS' or request.url_rule is None:
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        entry = {
+            'ts': round(time.time(), 4),
+            'method': request.method,
+            'route': request.url_rule.rule,
+            'view_args': {key: _clip(value) for key, value in (request.view_args or {}).items()},
+            'query': {key: _clip(value) for key, value in request.args.items() if key in QUERY_FIELDS},
+            'authenticated': request.headers.get('Authorization', '').startswith('Bearer '),
+            'client': self.client_id(request),
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 3)
+        }
+        for key in TEXT_FIELDS & request.args.keys():
+            entry['query'][key] = self.text_shape(request.args[key])
+        if 'cursor' in request.args:
+            entry['query']['cursor'] = True
+        body = request.get_json(silent=True) if request.is_json else None
+        if isinstance(body, dict):
+            entry['body'] = {key: _clip(value) for key, value in body.items() if key in BODY_FIELDS}
+            if 'feedback' in body:
+                entry['body']['feedback'] = bool(body['feedback'])
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)